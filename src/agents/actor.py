@@ -1,5 +1,12 @@
-import json
-from utils.ollama_utils import ollama_call
+import asyncio
+from utils.ollama_utils import async_ollama_call, record_attempts, run_sync
+from utils.llm_metrics import llm_call_tags
+from utils.json_utils import extract_json, JsonRepairError
+from utils.prompt_budget import PromptBudget
+from utils.model_router import ModelRouter
+from utils.tracing import span, traced
+from toolbox.tool_metadata import format_tool_catalogue
+from toolbox.tool_checks import check_tool_code
 import re
 import logging
 
@@ -11,15 +18,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# JSON schemas passed to Ollama's `format` so answers are always valid JSON
+TOOL_DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": ["use_tool", "create_tool"]},
+        "tool_name": {"type": "string"},
+        "tool_args": {"type": "object"},
+    },
+    "required": ["action", "tool_name", "tool_args"],
+}
+
+TOOL_DESIGN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tool_name": {"type": "string"},
+        "tool_description": {"type": "string"},
+        "args_description": {"type": "string"},
+    },
+    "required": ["tool_name", "tool_description", "args_description"],
+}
+
 class Actor:
-    def __init__(self, tool_manager, model: str = "gemma2:2b"):
+    def __init__(self, tool_manager, model: str = "gemma2:2b", executor=None, budget=None, artifact_store=None,
+                 router=None):
         self.tool_manager = tool_manager
         self.model = model
+        # utils.model_router.ModelRouter: the model of every call, all calls use `model` by default
+        self.router = router or ModelRouter(model)
+        # utils.prompt_budget.PromptBudget: token budgets of the prompt sections
+        self.budget = budget or PromptBudget(model)
+        # Optional toolbox.executor.ToolExecutor: runs tools in sandboxed worker processes
+        self.executor = executor
+        # Optional utils.artifact_store.ArtifactStore: large outputs are kept out of line
+        self.artifact_store = artifact_store
 
     def perform_subtask(self, subtask: dict, artifacts=None, critic_comment=None) -> dict:
+        """Synchronous version of async_perform_subtask."""
+        return run_sync(self.async_perform_subtask(subtask, artifacts, critic_comment))
+
+    async def _decision_prompt(self, subtask: dict, artifacts, critic_comment) -> list:
+        """
+        Builds the user messages of the tool decision: first the sorted catalogue of the relevant
+        tools, then the subtask, artifacts and critic feedback. The catalogue doesn't change between
+        the decisions of one subtask, so with the static system prompt it forms a stable prefix.
+        """
+        tool_query = f"{subtask['subtask']}\n{subtask.get('description', '')}"
+        tools = await asyncio.to_thread(self.tool_manager.relevant_tools, tool_query)
+        label = "Actor._get_tool_decision"
+        tools = self.budget.fit(label, "tools", tools)
+        artifacts = self.budget.fit(label, "artifacts", artifacts)
+        critic_comment = self.budget.fit(label, "feedback", critic_comment)
+        return [
+            {"role": "user", "content": f"Existing Tools:\n{format_tool_catalogue(tools)}"},
+            {"role": "user", "content": f"Subtask: {subtask['subtask']}\nPrevious steps artifacts:{artifacts}\nFeedback from critic after previous try{critic_comment}"},
+        ]
+
+    @traced("Actor.decide")
+    async def async_decide(self, subtask: dict, artifacts=None, critic_comment=None, options=None) -> dict:
+        """
+        Only asks for the tool decision of a subtask, without running or creating anything.
+        Returns {"prompt": ..., "decision": ...}; it can be passed to async_perform_subtask
+        as speculation and is used there if the prompt is still the same.
+        """
+        prompt = await self._decision_prompt(subtask, artifacts, critic_comment)
+        return {"prompt": prompt, "decision": await self._get_tool_decision(prompt, options=options)}
+
+    @traced("Actor.perform_subtask")
+    async def async_perform_subtask(self, subtask: dict, artifacts=None, critic_comment=None, options=None,
+                                    speculation=None, result=None, tool_name_suffix=None) -> dict:
         """
         Attempt to solve the subtask using available tools.
         If a needed tool doesn't exist, create it by generating the full Python file via Ollama.
+        options (temperature, seed, ...) are passed to every LLM call of this attempt.
+        speculation is a result of async_decide computed ahead of time; its decision is reused
+        (and speculation["used"] is set) if it was made from exactly the same prompt.
+        result, if given, is the dict that is filled in place and returned, so a caller that
+        cancels the attempt still knows which tool it created.
+        tool_name_suffix is appended to the name of a tool created by this attempt, see async_design_tool.
 
         Returns a dict:
         {
@@ -28,64 +104,117 @@ class Actor:
             "errors": "..." or None,
             "chosen_tool": "...",
             "created_tool": "...",
-            "tool_args": {...}
+            "tool_args": {...},
+            "status": "success" | "error" | "timeout" | "crash" or None if no tool was run
         }
         """
-        result = {"completed": False, "output": None, "errors": None, "chosen_tool": None, "created_tool": None, "tool_args": {}}
-        tools = self.tool_manager.list_tools()
-        decision = self._get_tool_decision(
-            subtask_prompt=f"Subtask: {subtask['subtask']}\nExisting Tools:\n{tools}.\nPrevious steps artifacts:{artifacts}\nFeedback from critic after previous try{critic_comment}"
-        )
+        result = result if result is not None else {}
+        result.update({"completed": False, "output": None, "errors": None, "chosen_tool": None, "created_tool": None, "tool_args": {}, "status": None})
+        prompt = await self._decision_prompt(subtask, artifacts, critic_comment)
+        if speculation is not None and speculation["prompt"] == prompt:
+            decision = speculation["decision"]
+            speculation["used"] = True
+        else:
+            decision = await self._get_tool_decision(prompt, options=options)
         if not decision:
             result["errors"] = "Failed to parse Ollama response."
             return result
         result['tool_args'] = decision.get("tool_args", {})
         if decision.get("action") == "create_tool":
-            new_tool_name = self.design_tool(subtask, artifacts, critic_comment)
+            new_tool_name = await self.async_design_tool(subtask, artifacts, critic_comment, options=options,
+                                                         name_suffix=tool_name_suffix)
             if not new_tool_name:
                 result["errors"] = "Failed to create new tool."
                 return result
             result['created_tool'] = new_tool_name
-            tools = self.tool_manager.list_tools()
-            decision = self._get_tool_decision(
-                subtask_prompt=f"Subtask: {subtask['subtask']}\nExisting Tools:\n{tools}.\nPrevious steps artifacts:{artifacts}\nFeedback from critic after previous try{critic_comment}"
-            )
+            prompt = await self._decision_prompt(subtask, artifacts, critic_comment)
+            decision = await self._get_tool_decision(prompt, options=options)
             result['tool_args'] = decision.get("tool_args", {})
             if not decision:
                 result["errors"] ="Failed to parse Ollama response after tool creation."
                 return result
+            if tool_name_suffix and f"{decision.get('tool_name')}{tool_name_suffix}" == new_tool_name:
+                # The model calls the tool by the name it designed
+                decision["tool_name"] = new_tool_name
 
         # Attempt to use the chosen tool
         chosen_tool = decision.get("tool_name")
+        tool_args = decision.get("tool_args", {})
+        if self.artifact_store is not None:
+            # Artifact references in the arguments are materialised only now
+            tool_args = await asyncio.to_thread(self.artifact_store.resolve, tool_args)
+        if chosen_tool and self.executor is not None:
+            return await self._run_in_executor(chosen_tool, tool_args, result)
         if chosen_tool:
-            tool_obj = self.tool_manager.get_tool(chosen_tool.lower())
+            tool_obj = await asyncio.to_thread(self.tool_manager.get_tool, chosen_tool.lower())
             if tool_obj:
                 try:
-                    output = tool_obj.run(**decision.get("tool_args", {}))
+                    # Tools are blocking code, keep them off the event loop
+                    with span("tool.run", tool=chosen_tool):
+                        output = await asyncio.to_thread(tool_obj.run, **tool_args)
                     result['completed'] = True
-                    result['output'] = output
+                    result['output'] = await self._store_output(output)
                     result['chosen_tool'] = chosen_tool
+                    result['status'] = "success"
                     return result
                 except Exception as e:
                     result['errors'] = str(e)
                     result['chosen_tool'] = chosen_tool
+                    result['status'] = "error"
                     return result
             else:
-                result['errors'] = f"Tool '{chosen_tool}' not found."
+                error = await asyncio.to_thread(self.tool_manager.tool_error, chosen_tool.lower())
+                result['errors'] = f"Tool '{chosen_tool}' failed to load: {error}" if error else f"Tool '{chosen_tool}' not found."
                 return result
         else:
             result['errors'] = "No tool chosen."
             return result
 
+    async def _run_in_executor(self, chosen_tool: str, tool_args: dict, result: dict) -> dict:
+        """
+        Runs the chosen tool in the sandboxed executor and fills result from its outcome.
+        """
+        tool_name = chosen_tool.lower()
+        # describe_tool doesn't import the tool, so no tool code runs in this process
+        if await asyncio.to_thread(self.tool_manager.describe_tool, tool_name) is None:
+            result['errors'] = f"Tool '{chosen_tool}' not found."
+            return result
+        if not isinstance(tool_args, dict):
+            tool_args = {}
+        with span("tool.run", tool=tool_name, sandboxed=True):
+            outcome = await asyncio.to_thread(self.executor.run, self.tool_manager._tool_filename(tool_name), tool_args)
+        logger.info(f"Tool '{tool_name}' finished with status {outcome['status']} in {outcome['duration']:.2f}s.")
+        result['chosen_tool'] = chosen_tool
+        result['status'] = outcome['status']
+        result['completed'] = outcome['status'] == "success"
+        result['output'] = await self._store_output(outcome['output'])
+        result['errors'] = outcome['error']
+        return result
+
+    async def _store_output(self, output):
+        """Moves a large tool output to the artifact store and returns its reference."""
+        if self.artifact_store is None:
+            return output
+        return await asyncio.to_thread(self.artifact_store.offload, output)
+
     def design_tool(self, subtask: dict, artifacts=None, critic_comment=None) -> bool:
+        """Synchronous version of async_design_tool."""
+        return run_sync(self.async_design_tool(subtask, artifacts, critic_comment))
+
+    @traced("Actor.design_tool")
+    async def async_design_tool(self, subtask: dict, artifacts=None, critic_comment=None, options=None,
+                                name_suffix=None) -> bool:
         """
         Design a new tool based on the subtask by interacting with Ollama.
         Generates the tool specifications and code, then saves it using ToolManager.
+        name_suffix is appended to the designed tool name, so parallel attempts that design
+        the same tool save their own versions. Returns the name the tool was saved under.
         """
-        design_tool = self._get_tool_design(
+        design_tool = await self._get_tool_design(
             description=subtask.get('description', 'No description provided.'),
             artifacts=artifacts,
-            critic_comment=critic_comment
+            critic_comment=critic_comment,
+            options=options
         )
         if not design_tool:
             print("Failed to obtain tool creation data from Ollama.")
@@ -96,27 +225,31 @@ class Actor:
             print(f"Design tool data missing required fields: {design_tool}")
             return None
 
-        tool_code = self._generate_tool_code(
+        tool_code = await self._generate_tool_code(
             tool_name=design_tool["tool_name"],
             tool_description=design_tool["tool_description"],
-            args_description=design_tool["args_description"]
+            args_description=design_tool["args_description"],
+            options=options
         )
 
         if not tool_code:
             print("Failed to generate tool code.")
             return None
 
-        save_success = self.tool_manager.add_tool(design_tool["tool_name"], tool_code)
+        tool_name = design_tool["tool_name"] + (name_suffix or "")
+        save_success = await asyncio.to_thread(self.tool_manager.add_tool, tool_name, tool_code)
         if not save_success:
-            print(f"Failed to save the new tool '{design_tool['tool_name']}'.")
+            print(f"Failed to save the new tool '{tool_name}'.")
             return None
 
-        logger.info(f"Successfully created and saved tool '{design_tool['tool_name']}'.")
-        return design_tool["tool_name"]
+        logger.info(f"Successfully created and saved tool '{tool_name}'.")
+        return tool_name
 
-    def _generate_tool_code(self, tool_name: str, tool_description: str, args_description: str) -> str:
+    async def _generate_tool_code(self, tool_name: str, tool_description: str, args_description: str, options=None) -> str:
         """
         Generate the full Python code for a new tool using Ollama.
+        Code that fails the static checks of toolbox.tool_checks.check_tool_code is never saved:
+        the problems are sent back to the model, which gets another attempt.
         """
         example_tool = """
 from toolbox.base_tool import Tool
@@ -159,20 +292,32 @@ You are autonomous agent: avoid any user input calls, always use arguments inste
         # Attempt to get the tool code from Ollama
         for attempt in range(3):
             try:
-                response = ollama_call(messages, model=self.model)
+                with llm_call_tags(agent="Actor", method="_generate_tool_code", attempt=attempt):
+                    response = await async_ollama_call(messages, model=self.router.model("Actor._generate_tool_code", attempt),
+                                                       options=options, use_cache=attempt == 0)
                 logger.debug(f"Ollama Tool Code Response: {response}")
 
                 tool_code = self._extract_code(response, language="python")
-                if tool_code:
-                    return tool_code
-                else:
+                if not tool_code:
                     print("No Python code found in the response.")
+                    continue
+                problems = check_tool_code(tool_code)
+                if not problems:
+                    record_attempts("Actor._generate_tool_code", attempt + 1)
+                    return tool_code
+                print(f"Generated code of tool '{tool_name}' rejected: {problems}. Attempt {attempt + 1}")
+                messages = messages[:2] + [
+                    {"role": "assistant", "content": response},
+                    {"role": "user", "content": "The code has these problems, answer with the corrected code only:\n"
+                                                + "\n".join(f"- {problem}" for problem in problems)},
+                ]
             except Exception as e:
                 print(f"Attempt {attempt + 1}: Failed to generate tool code. Error: {e}")
 
+        record_attempts("Actor._generate_tool_code", 3, succeeded=False)
         return ""
 
-    def _get_tool_decision(self, subtask_prompt: str) -> dict:
+    async def _get_tool_decision(self, prompt_messages: list, options=None) -> dict:
         """
         Helper method to get a tool decision from Ollama.
         Otherwise, comments are removed.
@@ -181,6 +326,7 @@ You are autonomous agent: avoid any user input calls, always use arguments inste
         system_content = """You are an actor that decides which tool from custom toolbox to use or to create a new tool to accomplish the subtask. 
 use_tool option for calling existing tool, create_tool - for implementing new tools. Maintain parameterizability to ensure the tool's broad applicability.
 Choose only existing tools to use
+Large outputs of previous steps are shown as {"artifact": "artifact:sha256:...", "preview": "..."}; pass the artifact string as a tool argument to give the tool the full content
 Return json only without comments
 Output sample:
 {
@@ -190,29 +336,49 @@ Output sample:
 }
 """
 
-        messages = [
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": subtask_prompt}
-        ]
+        messages = [{"role": "system", "content": system_content}] + prompt_messages
 
+        label = "Actor._get_tool_decision"
+        escalate = False
         for attempt in range(3):
             try:
-                response = ollama_call(messages, model=self.model)
+                with llm_call_tags(agent="Actor", method="_get_tool_decision", attempt=attempt):
+                    response = await async_ollama_call(messages, model=self.router.model(label, attempt, escalate),
+                                                       options=options, use_cache=attempt == 0, stream_json=True,
+                                                       format=TOOL_DECISION_SCHEMA)
                 logger.debug(f"Ollama Decision Response: {response}")
-                response_json = self._extract_json(response)
-                decision = json.loads(response_json)
+                decision, repairs = extract_json(response)
+                if (not escalate and attempt < 2 and self.router.can_escalate(label)
+                        and await self._uses_unknown_tool(decision)):
+                    # Low confidence: the model wants a tool that isn't in the toolbox, ask the bigger one
+                    logger.info(f"Tool decision {decision} uses an unknown tool, escalating. Attempt {attempt + 1}")
+                    escalate = True
+                    continue
+                record_attempts(label, attempt + 1, repairs=repairs)
                 return decision
-            except json.JSONDecodeError:
+            except JsonRepairError:
                 print(f'Incorrect JSON format, trying again. Attempt {attempt + 1}')
             except Exception as e:
                 print(f'Unexpected error: {e}, trying again. Attempt {attempt + 1}')
 
+        record_attempts(label, 3, succeeded=False)
         return None
 
-    def _get_tool_design(self, description: str, artifacts, critic_comment) -> dict:
+    async def _uses_unknown_tool(self, decision) -> bool:
+        """True if the decision is to use a tool the toolbox doesn't have."""
+        if not isinstance(decision, dict) or decision.get("action") != "use_tool":
+            return False
+        tool_name = decision.get("tool_name")
+        if not tool_name:
+            return True
+        return await asyncio.to_thread(self.tool_manager.describe_tool, tool_name.lower()) is None
+
+    async def _get_tool_design(self, description: str, artifacts, critic_comment, options=None) -> dict:
         """
         Helper method to obtain tool design JSON from Ollama.
         """
+        artifacts = self.budget.fit("Actor._get_tool_design", "artifacts", artifacts)
+        critic_comment = self.budget.fit("Actor._get_tool_design", "feedback", critic_comment)
         tool_creation_messages = [
             {
                 "role": "system", 
@@ -233,30 +399,22 @@ Format the entire response as JSON only without comments."""
 
         for attempt in range(3):
             try:
-                tool_creation_response = ollama_call(tool_creation_messages, model=self.model)
+                with llm_call_tags(agent="Actor", method="_get_tool_design", attempt=attempt):
+                    tool_creation_response = await async_ollama_call(tool_creation_messages, model=self.router.model("Actor._get_tool_design", attempt), options=options, use_cache=attempt == 0,
+                                                                     stream_json=True, format=TOOL_DESIGN_SCHEMA)
                 logger.debug(f"Ollama Tool Creation Response: {tool_creation_response}")
 
-                tool_creation_response = self._extract_json(tool_creation_response)
-                design_tool = json.loads(tool_creation_response)
+                design_tool, repairs = extract_json(tool_creation_response)
+                record_attempts("Actor._get_tool_design", attempt + 1, repairs=repairs)
                 return design_tool
-            except json.JSONDecodeError:
+            except JsonRepairError:
                 print(f"Failed to parse tool creation JSON from Ollama, trying again. Attempt {attempt + 1}")
             except Exception as e:
                 print(f"Unexpected error during tool creation: {e}, trying again. Attempt {attempt + 1}")
 
+        record_attempts("Actor._get_tool_design", 3, succeeded=False)
         return {}
 
-    def _extract_json(self, response: str) -> str:
-        """
-        Extract JSON content from the response, handling possible code fences.
-        """
-        json_fence = '```json'
-        if json_fence in response:
-            response = response.split(json_fence)[-1]
-        if '```' in response:
-            response = response.split('```')[0]
-        return response.strip()
-
     def _extract_code(self, response: str, language: str = "python") -> str:
         """
         Extract code block from the response based on the specified language.
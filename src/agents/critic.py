@@ -1,25 +1,74 @@
 import json
 import os
-from utils.ollama_utils import ollama_call
-import ast
+import asyncio
+from utils.ollama_utils import async_ollama_call, record_attempts, run_sync
+from utils.llm_metrics import llm_call_tags
+from utils.json_utils import extract_json, JsonRepairError
+from utils.prompt_budget import PromptBudget
+from utils.model_router import ModelRouter
+from utils.tracing import traced
+from toolbox.tool_checks import check_tool_code
 
-def is_executable_script(tool_code):
-    try:
-        ast.parse(tool_code)
+# JSON schema passed to Ollama's `format` so the verdict is always valid JSON
+CRITIC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "report": {"type": "string"},
+        "is_correct": {"type": "boolean"},
+    },
+    "required": ["report", "is_correct"],
+}
+
+CRITIC_SYSTEM_PROMPT = ("You are a critic evaluating if the chosen tool and approach are correct for the given subtask.\n"
+                        "Decide if this approach solves the subtask correctly. It shouldn't be perfect, it should at least work"
+                        "Describe what was done and what was good and bad. "
+                        "Return a JSON response with keys: 'report' (string), 'is_correct' (bool)")
+
+def is_low_confidence(verdict) -> bool:
+    """
+    A verdict worth a second opinion: required fields missing or empty. Failed attempts
+    never get to the LLM, see check_actor_output.
+    """
+    return not isinstance(verdict, dict) or not isinstance(verdict.get("is_correct"), bool) or not verdict.get("report")
+
+def is_empty_output(output) -> bool:
+    """None, blank strings and empty collections; 0 and False are real results."""
+    if output is None:
         return True
-    except SyntaxError as e:
-        print(f"Syntax Error: {e}")
-        return False
-    except Exception as e:
-        print(f"Other Error: {e}")
-        return False
+    if isinstance(output, str):
+        return not output.strip()
+    if isinstance(output, (list, tuple, dict, set, bytes)):
+        return len(output) == 0
+    return False
+
+def check_actor_output(actor_output: dict) -> list:
+    """Problems visible in the attempt's result alone: errors, exceptions of the tool, no output."""
+    problems = []
+    if actor_output.get("errors"):
+        problems.append(f"The attempt failed with status '{actor_output.get('status')}': {actor_output['errors']}")
+    elif not actor_output.get("completed"):
+        problems.append("The attempt didn't complete.")
+    elif is_empty_output(actor_output.get("output")):
+        problems.append("The tool returned no output.")
+    return problems
 
 class Critic:
-    def __init__(self, tool_manager, model: str = "gemma2:2b"):
+    def __init__(self, tool_manager, model: str = "gemma2:2b", budget=None, router=None):
         self.tool_manager = tool_manager
         self.model = model
+        # Verdicts given by the pre-checks without an LLM call and by the LLM
+        self.stats = {"prechecked": 0, "llm": 0}
+        # utils.model_router.ModelRouter: the model of every call, all calls use `model` by default
+        self.router = router or ModelRouter(model)
+        # utils.prompt_budget.PromptBudget: token budgets of the prompt sections
+        self.budget = budget or PromptBudget(model)
 
     def evaluate(self, subtask: dict, actor_output: dict) -> dict:
+        """Synchronous version of async_evaluate."""
+        return run_sync(self.async_evaluate(subtask, actor_output))
+
+    @traced("Critic.evaluate")
+    async def async_evaluate(self, subtask: dict, actor_output: dict) -> dict:
         """
         Evaluate the actor’s output to decide if the chosen tool and approach are correct.
         
@@ -32,11 +81,16 @@ class Critic:
             'errors': ...,
             'chosen_tool': 'ToolName',
             'created_tool': 'ToolName',
+            'status': 'success' | 'error' | 'timeout' | 'crash' | None,
           }
 
         The Critic will:
-        1. Fetch the tool code of the chosen tool (if any).
-        2. Use an LLM (Ollama) to determine if this approach is correct and meets the subtask criteria.
+        1. Reject attempts that failed, raised or returned nothing right away, without an LLM call.
+        2. Fetch the tool code of the chosen tool (if any) and reject it right away if it fails
+           the static checks of toolbox.tool_checks.check_tool_code. The Actor already checks the
+           code it generates, this is a backstop for tools written or edited elsewhere.
+        3. Use an LLM (Ollama) to determine if this approach is correct and meets the subtask criteria.
+        A tool created in this attempt is deleted when it's rejected.
         
         The LLM should return JSON such as:
         {
@@ -48,6 +102,10 @@ class Critic:
         A dict with keys "is_correct", "report".
         """
         chosen_tool = actor_output.get("chosen_tool")
+        problems = check_actor_output(actor_output)
+        if problems:
+            return await self._reject(actor_output, problems)
+
         tool_code = "No tool chosen."
         if chosen_tool:
             # Get the tool code from the ToolManager
@@ -61,61 +119,69 @@ class Critic:
                     "is_correct": False,
                     "report": f"Tool {chosen_tool} code not found.",
                 }
-                
+            problems = check_tool_code(tool_code)
+            if problems:
+                return await self._reject(actor_output, problems)
 
         # Prepare the prompt for the LLM
-        # The system message instructs the LLM about its role
-        # The user message provides the subtask, actor_output, and tool code,
-        # and requests a JSON response.
+        # The system message instructs the LLM about its role and requests a JSON response.
+        # The user messages provide the tool code (the same for every evaluation of the tool),
+        # then the volatile subtask and actor_output, so repeated evaluations share a prompt prefix
         messages = [
-            {
-                "role": "system",
-                "content": "You are a critic evaluating if the chosen tool and approach are correct for the given subtask."
-            },
+            {"role": "system", "content": CRITIC_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Tool Code:\n```python\n{tool_code}\n```"},
             {
                 "role": "user",
                 "content": (
                     f"Subtask: {json.dumps(subtask, indent=2)}\n"
-                    f"Actor output: {json.dumps(actor_output, indent=2)}\n\n"
-                    f"Tool Code:\n```python\n{tool_code}\n```\n\n"
-                    "Decide if this approach solves the subtask correctly. It shouldn't be perfect, it should at least work"
-                    "Describe what was done and what was good and bad. "
-                    "Return a JSON response with keys: 'report' (string), 'is_correct' (bool)"
+                    f"Actor output: {json.dumps(self.budget.fit('Critic.evaluate', 'artifacts', actor_output), indent=2, default=str)}"
                 )
             }
         ]
+        self.stats["llm"] += 1
+        escalate = False
         for attempt in range(3):
             try:
-                response = ollama_call(messages, model=self.model)
-                parsed = json.loads(self._extract_json(response))
+                with llm_call_tags(agent="Critic", method="evaluate", attempt=attempt):
+                    response = await async_ollama_call(messages, model=self.router.model("Critic.evaluate", attempt, escalate),
+                                                       use_cache=attempt == 0, stream_json=True, format=CRITIC_SCHEMA)
+                parsed, repairs = extract_json(response)
+                if (not escalate and attempt < 2 and self.router.can_escalate("Critic.evaluate")
+                        and is_low_confidence(parsed)):
+                    # Let the bigger model decide instead of falling back or trusting a doubtful verdict
+                    print(f'Doubtful verdict {parsed}, escalating. Attempt {attempt + 1}')
+                    escalate = True
+                    continue
+                record_attempts("Critic.evaluate", attempt + 1, repairs=repairs)
                 # Ensure the required fields are present; if not, fallback
                 if "is_correct" not in parsed or "report" not in parsed:
                     if actor_output.get("created_tool") == actor_output.get("chosen_tool"):
-                        self.tool_manager.delete_tool(chosen_tool)
+                        await asyncio.to_thread(self.tool_manager.delete_tool, chosen_tool)
                     return {
                         "is_correct": actor_output.get("is_correct", False),
                         "report": "LLM did not provide required fields. Using fallback.",
                     }
-                if actor_output.get("created_tool") == actor_output.get("chosen_tool") and (not is_executable_script(tool_code) or not parsed['is_correct']):
-                    self.tool_manager.delete_tool(chosen_tool)
+                if actor_output.get("created_tool") == actor_output.get("chosen_tool") and not parsed['is_correct']:
+                    await asyncio.to_thread(self.tool_manager.delete_tool, chosen_tool)
                 return parsed
-            except json.JSONDecodeError:
+            except JsonRepairError:
                 if actor_output.get("created_tool") == actor_output.get("chosen_tool"):
-                    self.tool_manager.delete_tool(chosen_tool)
+                    await asyncio.to_thread(self.tool_manager.delete_tool, chosen_tool)
                 print(f'Json parsing failed on attempt {attempt}')
 
+        record_attempts("Critic.evaluate", 3, succeeded=False)
         return {
             "is_correct": False,
             "report": "Unable to parse LLM's response; fallback used.",
         }
-        
 
-    def _extract_json(self, response: str) -> str:
-        """
-        Extract the JSON content from the LLM response, handling code fences if present.
-        """
-        if '```json' in response:
-            response = response.split('```json', 1)[-1]
-        if '```' in response:
-            response = response.split('```', 1)[0]
-        return response.strip()
\ No newline at end of file
+    async def _reject(self, actor_output: dict, problems: list) -> dict:
+        """Verdict of a failed pre-check; a tool created in this attempt is deleted."""
+        self.stats["prechecked"] += 1
+        chosen_tool = actor_output.get("chosen_tool")
+        if chosen_tool and actor_output.get("created_tool") == chosen_tool:
+            await asyncio.to_thread(self.tool_manager.delete_tool, chosen_tool)
+        return {
+            "is_correct": False,
+            "report": f"Pre-check of tool {chosen_tool} failed: " + " ".join(problems),
+        }
@@ -1,6 +1,13 @@
 import os
-import json
-from utils.ollama_utils import ollama_call
+import asyncio
+from utils.ollama_utils import async_ollama_call, record_attempts, run_sync
+from utils.llm_metrics import llm_call_tags
+from utils.json_utils import extract_json
+from utils.prompt_budget import PromptBudget
+from utils.model_router import ModelRouter
+from utils.tracing import traced
+from memory.episodic import format_episodes, format_summaries
+from toolbox.tool_metadata import format_tool_catalogue
 import logging
 
 logging.basicConfig(
@@ -11,22 +18,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-INITIATOR_SYSTEM_PROMPT = "You are a task generator that produces a json with keys 'task_description' and 'success_criteria'.\
-Don't add anything except json"
-
-INITIATOR_PROMPT = """You are self-improving system.
-You have list of tools to do task. Tools can solve atomic tasks. Here is a list of existing tools:
-{list_tool}
-Based on memory:\n{memory}
-Generate a new task. The task should be clear, specific, not abstract and achievable as a user request.
+INITIATOR_SYSTEM_PROMPT = """You are a task generator that produces a json with keys 'task_description' and 'success_criteria'.\
+Don't add anything except json
+You are self-improving system.
+You have list of tools to do task. Tools can solve atomic tasks.
+Generate a new task based on the memory. The task should be clear, specific, not abstract and achievable as a user request.
 Each iteration you need to do something new, don't generate tasks that only reuses existing tools."""
 
+INITIATOR_TOOLS_PROMPT = """Here is a list of existing tools:
+{list_tool}"""
+
+INITIATOR_MEMORY_PROMPT = "Memory:\n{memory}"
+
+EPISODE_MEMORY_PROMPT = """Long-term goals and notes:
+{notes}
+Summary of the history:
+{summaries}
+Previous iterations relevant now:
+{episodes}"""
+
+SUMMARY_SYSTEM_PROMPT = ("You compress the memory of a self-improving agent system. You will receive consecutive notes "
+                         "about its iterations. Merge them into one summary of at most {words} words. Keep concrete "
+                         "facts: tools that were created or are missing, recurring failures and their causes, what "
+                         "worked, and open goals. Plain text, no JSON.")
+
+LESSONS_SYSTEM_PROMPT = ("You are a memory writer of a self-improving agent system. You will receive one finished "
+                         "iteration: the task, if it succeeded, the plan and the artifacts. Write the lessons of this "
+                         "iteration in a few sentences: what worked, what failed and why, which tools were created or "
+                         "are missing, and what to try next. Plain text, no JSON.")
+
+# JSON schema passed to Ollama's `format` so the task is always valid JSON
+TASK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "task_description": {"type": "string"},
+        "success_criteria": {"type": "string"},
+    },
+    "required": ["task_description", "success_criteria"],
+}
+
 
 class Initiator:
-    def __init__(self, tool_manager, memory_file: str = "notes.txt", model: str = "gemma2:2b"):
+    def __init__(self, tool_manager, memory_file: str = "notes.txt", model: str = "gemma2:2b", budget=None,
+                 episodic_memory=None, memory_top_k: int = 5, summary_fanout: int = 4, summary_words: int = 150,
+                 router=None):
         self.memory_file = memory_file
         self.model = model
+        # utils.model_router.ModelRouter: the model of every call, all calls use `model` by default
+        self.router = router or ModelRouter(model)
         self.tool_manager = tool_manager
+        # utils.prompt_budget.PromptBudget: token budgets of the prompt sections
+        self.budget = budget or PromptBudget(model)
+        # Optional memory.episodic.EpisodicMemory: one episode per iteration instead of
+        # rewriting memory_file, which then only holds the long-term goals
+        self.episodic_memory = episodic_memory
+        self.memory_top_k = memory_top_k
+        # Summary levels: `summary_fanout` pending entries of a level are rolled up into one of the next
+        self.summary_fanout = summary_fanout
+        self.summary_words = summary_words
         if not os.path.exists(self.memory_file):
             logger.debug(f"Memory file {self.memory_file} not found. Creating a new one.")
             open(self.memory_file, 'w').close()
@@ -40,34 +89,62 @@ class Initiator:
         with open(self.memory_file, 'w') as f:
             f.write(text + "\n")
 
+    def read_relevant_memory(self) -> str:
+        """
+        The memory shown to the task generator: the notes file, plus the top-k relevant
+        episodes if episodic memory is used.
+        """
+        notes = self.read_long_term_memory()
+        if self.episodic_memory is None:
+            return notes
+        latest = self.episodic_memory.recent(1)
+        query = notes + "".join(f"\n{episode['task']}\n{episode['lessons']}" for episode in latest)
+        episodes = self.episodic_memory.relevant(query, k=self.memory_top_k)
+        return EPISODE_MEMORY_PROMPT.format(notes=notes.strip(),
+                                            summaries=format_summaries(self.episodic_memory.memory_summaries()),
+                                            episodes=format_episodes(episodes))
+
     def generate_task(self) -> dict:
+        """Synchronous version of async_generate_task."""
+        return run_sync(self.async_generate_task())
+
+    @traced("Initiator.generate_task")
+    async def async_generate_task(self) -> dict:
         """
         Use Ollama to generate a high-level task and success criteria.
         We will ask it to respond in JSON format.
         """
+        memory = await asyncio.to_thread(self.read_relevant_memory)
+        list_tools = await asyncio.to_thread(self.tool_manager.relevant_tools, memory)
+        list_tools = self.budget.fit("Initiator.generate_task", "tools", list_tools)
+        memory = self.budget.fit("Initiator.generate_task", "memory", memory)
+        # No task exists yet, so the memory decides which tools are relevant.
+        # Instructions, tools and memory go in that order, from the most to the least stable
         messages = [
             {"role": "system", "content": INITIATOR_SYSTEM_PROMPT},
-            {
-                "role": "user", 
-                "content": INITIATOR_PROMPT.format(
-                    list_tool=self.tool_manager.list_tools(), 
-                    memory = self.read_long_term_memory()
-                )
-            }
+            {"role": "user", "content": INITIATOR_TOOLS_PROMPT.format(list_tool=format_tool_catalogue(list_tools))},
+            {"role": "user", "content": INITIATOR_MEMORY_PROMPT.format(memory=memory)}
         ]
         logger.debug(f"Initiator full prompt: {messages}")
         for i in range(3):
             try:
-                response = ollama_call(messages, model=self.model)
-                response = response.split('```json')[-1]
-                response = response.replace('```', '')
-                data = json.loads(response)
+                with llm_call_tags(agent="Initiator", method="generate_task", attempt=i):
+                    response = await async_ollama_call(messages, model=self.router.model("Initiator.generate_task", i), use_cache=i == 0, stream_json=True,
+                                                       format=TASK_SCHEMA)
+                data, repairs = extract_json(response)
                 logger.debug(f"Initiator output: {data}")
+                record_attempts("Initiator.generate_task", i + 1, repairs=repairs)
                 return data
-            except Exception:
+            except Exception as e:
                 logger.warning(f"Incorrect JSON format, attempt {i+1} failed. Trying again: {e}")
-                
+        record_attempts("Initiator.generate_task", 3, succeeded=False)
+
     def conclude(self, succeeded, task_info: dict, plan, artifacts):
+        """Synchronous version of async_conclude."""
+        return run_sync(self.async_conclude(succeeded, task_info, plan, artifacts))
+
+    @traced("Initiator.conclude")
+    async def async_conclude(self, succeeded, task_info: dict, plan, artifacts):
         """
         Conclude the task and update the memory.
         This method:
@@ -77,8 +154,14 @@ class Initiator:
             - Asks the model to generate new notes that incorporate previous notes.
             - Ensures some text from the old memory is kept.
             - Writes the updated memory back to the memory file.
+        With episodic memory the notes file isn't rewritten, see _conclude_episode.
         """
-        previous_memory = self.read_long_term_memory()
+        if self.episodic_memory is not None:
+            return await self._conclude_episode(succeeded, task_info, plan, artifacts)
+
+        previous_memory = self.budget.fit("Initiator.conclude", "memory", self.read_long_term_memory())
+        plan = self.budget.fit("Initiator.conclude", "plan", plan)
+        artifacts = self.budget.fit("Initiator.conclude", "artifacts", artifacts)
 
         # Build a prompt to incorporate old memory with new details.
         # You can adjust the wording/structure below according to your usage.
@@ -114,7 +197,8 @@ class Initiator:
         logger.debug(f"Conclude prompt: {messages}")
 
         try:
-            new_memory = ollama_call(messages, model=self.model).strip()
+            with llm_call_tags(agent="Initiator", method="conclude"):
+                new_memory = (await async_ollama_call(messages, model=self.router.model("Initiator.conclude"))).strip()
             logger.debug(f"New memory response: {new_memory}")
             
             # Update the file with the newly generated memory
@@ -122,4 +206,74 @@ class Initiator:
             logger.info("Memory has been updated successfully in 'conclude'.")
         except Exception as e:
             logger.error(f"Error during concluding step: {e}")
-        return new_memory
\ No newline at end of file
+        return new_memory
+
+    @staticmethod
+    def _outcome(succeeded, artifacts) -> str:
+        """Short outcome of an iteration: the status of each subtask and its number of attempts."""
+        lines = [f"Task {'succeeded' if succeeded else 'failed'}."]
+        for subtask, attempts in (artifacts or {}).items():
+            if isinstance(attempts, list):
+                completed = any(attempt.get('completed') for attempt in attempts if isinstance(attempt, dict))
+                lines.append(f"{subtask}: {'completed' if completed else 'failed'} after {len(attempts)} attempts")
+        return "\n".join(lines)
+
+    async def _conclude_episode(self, succeeded, task_info: dict, plan, artifacts) -> str:
+        """
+        Asks the model for the lessons of this iteration only and appends them as a new episode,
+        so the cost of concluding doesn't grow with the history.
+        """
+        messages = [
+            {"role": "system", "content": LESSONS_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": (
+                    f"Task Succeeded: {succeeded}\n"
+                    f"Task Info: {task_info}\n"
+                    f"Plan: {self.budget.fit('Initiator.conclude', 'plan', plan)}\n"
+                    f"Artifacts: {self.budget.fit('Initiator.conclude', 'artifacts', artifacts)}\n"
+                )
+            }
+        ]
+        logger.debug(f"Conclude prompt: {messages}")
+        lessons = ""
+        try:
+            with llm_call_tags(agent="Initiator", method="conclude"):
+                lessons = (await async_ollama_call(messages, model=self.router.model("Initiator.conclude"))).strip()
+        except Exception as e:
+            logger.error(f"Error during concluding step: {e}")
+        task = task_info.get('task_description', str(task_info)) if isinstance(task_info, dict) else str(task_info)
+        episode_id = await asyncio.to_thread(self.episodic_memory.add, task, plan, succeeded,
+                                             self._outcome(succeeded, artifacts), lessons)
+        logger.info(f"Stored episode #{episode_id} in episodic memory.")
+        await self._compact_memory()
+        return lessons
+
+    async def _compact_memory(self):
+        """
+        Rolls up every summary level that has summary_fanout pending entries into one entry
+        of the next level, cascading upwards. Each roll-up reads a fixed number of bounded
+        entries, so the cost per iteration doesn't depend on the length of the history.
+        """
+        level = 0
+        while True:
+            sources = await asyncio.to_thread(self.episodic_memory.pending_summaries, level, self.summary_fanout)
+            if len(sources) < self.summary_fanout:
+                return
+            notes = "\n".join(f"- {self.budget.fit('Initiator.compact_memory', 'memory', source['text'])}"
+                              for source in sources)
+            messages = [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(words=self.summary_words)},
+                {"role": "user", "content": f"Notes:\n{notes}"},
+            ]
+            try:
+                with llm_call_tags(agent="Initiator", method="compact_memory", level=level + 1):
+                    # About 2 tokens per word keeps the summary size fixed
+                    summary = (await async_ollama_call(messages, model=self.router.model("Initiator.compact_memory"),
+                                                       options={"num_predict": self.summary_words * 2})).strip()
+            except Exception as e:
+                logger.error(f"Error while summarising memory level {level}: {e}")
+                return
+            summary_id = await asyncio.to_thread(self.episodic_memory.add_summary, level + 1, sources, summary)
+            logger.info(f"Rolled up {len(sources)} level-{level} memory entries into summary #{summary_id}.")
+            level += 1
@@ -1,6 +1,12 @@
 # planner.py
-import json
-from utils.ollama_utils import ollama_call
+import asyncio
+from utils.ollama_utils import async_ollama_call, record_attempts, run_sync
+from utils.llm_metrics import llm_call_tags
+from utils.json_utils import extract_json, JsonRepairError
+from utils.prompt_budget import PromptBudget
+from utils.model_router import ModelRouter
+from utils.tracing import traced
+from toolbox.tool_metadata import format_tool_catalogue
 import logging
 
 logging.basicConfig(
@@ -14,50 +20,106 @@ logger = logging.getLogger(__name__)
 PLANNER_SYSTEM_PROMPT = "You are a planner that takes a task and produces subtasks as a JSON list. Don't add anything except json"
 "You are creating a plan for agent system, so you need to create subtasks, which are possible to solve using python scripts"
 
-PLANNER_PROMPT = """Here is a list of existing tools:
-{list_tools}
-Task: {task}
-
-Output format:
+PLANNER_OUTPUT_FORMAT = """Output format:
 [
-    {{
-        'subtask': 'subtask name',
-        'description': 'description of subtask',
-        'success_criteria': 'success criteria of this subtask'
-    }},
-    {{
+    {
+        "subtask": "subtask name",
+        "description": "description of subtask",
+        "success_criteria": "success criteria of this subtask"
+    },
+    {
         ...
-    }}
+    }
 ]"""
 
+PLANNER_TOOLS_PROMPT = """Here is a list of existing tools:
+{list_tools}"""
+
+PLANNER_TASK_PROMPT = "Task: {task}"
+
 REPLANNER_PROMPT = """Previous iteration was failed, here is the logs in format:
 {previous_plan}
 {{'subtask_name': [{{'completed': True, 'output': 'output of subtask', 'critic_report': 'critic report of subtask'}}]}}
 {artifacts}"""
 
+# JSON schema passed to Ollama's `format` so the plan is always a valid JSON list
+PLAN_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "subtask": {"type": "string"},
+            "description": {"type": "string"},
+            "success_criteria": {"type": "string"},
+        },
+        "required": ["subtask", "description", "success_criteria"],
+    },
+}
+
+DEPENDENCIES_PROMPT = """Add a "depends_on" key to every subtask: a list with the names of the subtasks whose results it needs.
+Leave it empty if the subtask can be done on its own, so independent subtasks can run in parallel."""
+
+# Same as PLAN_SCHEMA with the dependency edges of the plan DAG
+PLAN_DAG_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            **PLAN_SCHEMA["items"]["properties"],
+            "depends_on": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": PLAN_SCHEMA["items"]["required"] + ["depends_on"],
+    },
+}
+
 class Planner:
-    def __init__(self, tool_manager, model: str = "gemma2:2b"):
+    def __init__(self, tool_manager, model: str = "gemma2:2b", with_dependencies: bool = False, budget=None,
+                 router=None):
         self.tool_manager = tool_manager
         self.model = model
+        # utils.model_router.ModelRouter: the model of every call, all calls use `model` by default
+        self.router = router or ModelRouter(model)
+        # utils.prompt_budget.PromptBudget: token budgets of the prompt sections
+        self.budget = budget or PromptBudget(model)
+        # Ask for "depends_on" edges so the plan can be executed as a DAG
+        self.with_dependencies = with_dependencies
 
     def create_plan(self, task_info: str, artifacts=None, previous_plan=None):
+        """Synchronous version of async_create_plan."""
+        return run_sync(self.async_create_plan(task_info, artifacts, previous_plan))
+
+    @traced("Planner.create_plan")
+    async def async_create_plan(self, task_info: str, artifacts=None, previous_plan=None):
         """Ask Ollama to break down the task into a list of subtasks."""
+        list_tools = await asyncio.to_thread(self.tool_manager.relevant_tools, task_info['task_description'])
+        list_tools = self.budget.fit("Planner.create_plan", "tools", list_tools)
+        # Static instructions, then the tools, then the task: the most stable parts come first
+        # so consecutive calls share the longest possible prompt prefix
+        system_prompt = f"{PLANNER_SYSTEM_PROMPT}\n\n{PLANNER_OUTPUT_FORMAT}"
+        if self.with_dependencies:
+            system_prompt += f"\n\n{DEPENDENCIES_PROMPT}"
         messages = [
-            {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
-            {"role": "user", "content": PLANNER_PROMPT.format(list_tools = self.tool_manager.list_tools(), task=task_info['task_description'])}
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": PLANNER_TOOLS_PROMPT.format(list_tools=format_tool_catalogue(list_tools))},
+            {"role": "user", "content": PLANNER_TASK_PROMPT.format(task=task_info['task_description'])}
         ]
         if artifacts is not None:
-            replanner_prompt = REPLANNER_PROMPT.format(previous_plan=previous_plan, artifacts=artifacts)
+            replanner_prompt = REPLANNER_PROMPT.format(
+                previous_plan=self.budget.fit("Planner.create_plan", "plan", previous_plan),
+                artifacts=self.budget.fit("Planner.create_plan", "artifacts", artifacts)
+            )
             messages.append({"role": "user", "content": replanner_prompt})
 
         logger.debug(f"Planner full prompt: {messages}")
         for i in range(3):
             try:
-                response = ollama_call(messages, model=self.model)
-                response = response.split('```json')[-1]
-                response = response.replace('```', '')
-                data = json.loads(response)
+                with llm_call_tags(agent="Planner", method="create_plan", attempt=i):
+                    response = await async_ollama_call(messages, model=self.router.model("Planner.create_plan", i), use_cache=i == 0, stream_json=True,
+                                                       format=PLAN_DAG_SCHEMA if self.with_dependencies else PLAN_SCHEMA)
+                data, repairs = extract_json(response)
                 logger.debug(f"Planner output: {data}")
+                record_attempts("Planner.create_plan", i + 1, repairs=repairs)
                 return data
-            except json.JSONDecodeError as e:
-                logger.warning(f"Incorrect JSON format, attempt {i+1} failed. Trying again: {e}")
\ No newline at end of file
+            except JsonRepairError as e:
+                logger.warning(f"Incorrect JSON format, attempt {i+1} failed. Trying again: {e}")
+        record_attempts("Planner.create_plan", 3, succeeded=False)
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""
+End-to-end benchmark of the improvement loop against the mock Ollama server.
+
+    python -m benchmarks.loop_benchmark --iterations 20 --latency 0.0
+
+Runs task -> plan -> actor/critic -> conclude iterations like improve_yourself.py,
+in a temporary toolbox, and reports iterations/s, LLM calls per iteration,
+the cost of listing the toolbox and memory use. With zero simulated latency the
+numbers measure the Python-side overhead of the orchestration only.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from agents.initiator import Initiator
+from agents.planner import Planner
+from agents.actor import Actor
+from agents.critic import Critic
+from memory.episodic import EpisodicMemory
+from toolbox.toolbox import ToolManager
+from toolbox.tool_retriever import ToolRetriever
+from toolbox.executor import ToolExecutor
+from orchestration.plan_execution import execute_plan, execute_plan_dag
+from utils.ollama_utils import configure_client, prefix_cache_stats
+from utils.llm_metrics import configure_metrics, metrics_summary
+from utils.model_router import ModelRouter
+from .mock_ollama import MockOllama
+
+
+async def run_iteration(initiator, planner, actor, critic, with_dependencies: bool, max_iterations: int = 3,
+                        max_attempts: int = 3) -> bool:
+    """One iteration of the loop, the same steps as improve_yourself.improve_once."""
+    task_info = await initiator.async_generate_task()
+    plan = await planner.async_create_plan(task_info)
+    clean_artifacts = {}
+    full_artifacts = {}
+    is_finished = False
+    for _ in range(max_iterations):
+        if with_dependencies:
+            failed_subtask = await execute_plan_dag(actor, critic, plan, clean_artifacts, full_artifacts,
+                                                    max_attempts=max_attempts)
+        else:
+            failed_subtask = await execute_plan(actor, critic, plan, clean_artifacts, full_artifacts,
+                                                max_attempts=max_attempts)
+        if failed_subtask is None:
+            is_finished = True
+            break
+        plan = await planner.async_create_plan(task_info, artifacts=clean_artifacts, previous_plan=plan)
+    await initiator.async_conclude(succeeded=is_finished, task_info=task_info, plan=plan, artifacts=full_artifacts)
+    return is_finished
+
+
+def _time_listing(tool_manager: ToolManager, repeat: int = 20) -> dict:
+    """Average seconds of a cold (invalidated) and a warm list_tools() call."""
+    cold = 0.0
+    warm = 0.0
+    for _ in range(repeat):
+        tool_manager.invalidate()
+        started_at = time.perf_counter()
+        tool_manager.list_tools()
+        cold += time.perf_counter() - started_at
+        started_at = time.perf_counter()
+        tool_manager.list_tools()
+        warm += time.perf_counter() - started_at
+    return {"cold": cold / repeat, "warm": warm / repeat}
+
+
+async def benchmark(iterations: int = 10, latency: float = 0.0, token_latency: float = 0.0, model: str = "qwen2.5-coder",
+                    with_dependencies: bool = True, sandbox: bool = False, extra_tools: int = 0,
+                    small_model: str = None, small_latency: float = 0.0) -> dict:
+    """
+    Runs the loop `iterations` times against a fresh mock server and toolbox and returns the report.
+    With small_model the critic verdicts and tool decisions are routed to it (first token after
+    small_latency seconds), escalating to `model` on a failed parse.
+    """
+    routes = {}
+    if small_model:
+        route = {"model": small_model, "escalate_to": model, "escalate_after": 1}
+        routes = {"Critic.evaluate": route, "Actor._get_tool_decision": route}
+    router = ModelRouter(model, routes=routes)
+    workdir = tempfile.mkdtemp(prefix="sokrates-bench-")
+    executor = None
+    try:
+        model_latency = {small_model: small_latency} if small_model else None
+        with MockOllama(latency=latency, token_latency=token_latency, model_latency=model_latency) as mock:
+            configure_client(host=mock.url)
+            configure_metrics(jsonl_path=None)
+            tools_dir = os.path.join(workdir, "tools")
+            os.makedirs(tools_dir)
+            # Padding tools make the toolbox listing cost visible
+            for i in range(extra_tools):
+                with open(os.path.join(tools_dir, f"padding_tool_{i}.py"), 'w') as f:
+                    f.write(f"from toolbox.base_tool import Tool\n\nclass PaddingTool{i}(Tool):\n"
+                            f"    @property\n    def tool_desc(self) -> str:\n        return 'Padding tool number {i}'\n\n"
+                            f"    @property\n    def param_desc(self) -> str:\n        return 'no params'\n\n"
+                            f"    @staticmethod\n    def run(**kwargs):\n        return {i}\n")
+
+            tool_manager = ToolManager(tools_dir=tools_dir, retriever=ToolRetriever())
+            if sandbox:
+                executor = ToolExecutor(workers=2)
+            episodic_memory = EpisodicMemory(os.path.join(workdir, "episodic_memory.sqlite"))
+            initiator = Initiator(tool_manager, memory_file=os.path.join(workdir, "notes.txt"), model=model,
+                                  episodic_memory=episodic_memory, router=router)
+            planner = Planner(tool_manager, model=model, with_dependencies=with_dependencies, router=router)
+            actor = Actor(tool_manager, model=model, executor=executor, router=router)
+            critic = Critic(tool_manager, model=model, router=router)
+
+            tracemalloc.start()
+            succeeded = 0
+            started_at = time.perf_counter()
+            for _ in range(iterations):
+                succeeded += await run_iteration(initiator, planner, actor, critic, with_dependencies)
+            elapsed = time.perf_counter() - started_at
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            listing = await asyncio.to_thread(_time_listing, tool_manager)
+            tools = tool_manager.list_tools()
+            requests = dict(mock.requests)
+            critic_verdicts = dict(critic.stats)
+            episodic_memory.close()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = metrics_summary()
+    calls = summary["calls"]
+    return {
+        "iterations": iterations,
+        "succeeded": succeeded,
+        "seconds": elapsed,
+        "iterations_per_second": iterations / elapsed if elapsed else None,
+        "llm_calls_per_iteration": requests["chat"] / iterations,
+        "embed_calls_per_iteration": requests["embed"] / iterations,
+        "llm_calls_by_agent": {label: group["calls"] for label, group in calls.items()},
+        "latency_by_route": {label: {model_name: route["total_latency"] for model_name, route in models.items()}
+                             for label, models in summary["routes"].items()},
+        "critic_verdicts": critic_verdicts,
+        "escalations": {label: stats["escalated"] for label, stats in router.stats().items() if stats["escalated"]},
+        "prompt_prefix_reuse": prefix_cache_stats()["hit_ratio"],
+        "toolbox_tools": len(tools) if isinstance(tools, dict) else 0,
+        "list_tools_seconds": listing,
+        "peak_traced_memory_mb": peak / 2 ** 20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds to the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Simulated seconds per streamed chunk")
+    parser.add_argument("--model", default="qwen2.5-coder")
+    parser.add_argument("--sequential", action="store_true", help="Run plans sequentially instead of as a DAG")
+    parser.add_argument("--sandbox", action="store_true", help="Run tools in the ToolExecutor worker pool")
+    parser.add_argument("--extra-tools", type=int, default=0, help="Padding tools added to the toolbox")
+    parser.add_argument("--small-model", help="Route critic verdicts and tool decisions to this model")
+    parser.add_argument("--small-latency", type=float, default=0.0, help="Simulated seconds to the first token of --small-model")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(iterations=args.iterations, latency=args.latency, token_latency=args.token_latency,
+                                   model=args.model, with_dependencies=not args.sequential, sandbox=args.sandbox,
+                                   extra_tools=args.extra_tools, small_model=args.small_model,
+                                   small_latency=args.small_latency))
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
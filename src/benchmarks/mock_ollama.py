@@ -0,0 +1,256 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from utils.llm_cache import request_key
+
+MOCK_TOOL_NAME = "echo_text"
+
+MOCK_TOOL_CODE = '''from toolbox.base_tool import Tool
+
+class EchoText(Tool):
+    @property
+    def tool_desc(self) -> str:
+        return "Returns the given text unchanged"
+
+    @property
+    def param_desc(self) -> str:
+        return "text: the text to return"
+
+    @staticmethod
+    def run(**kwargs):
+        return kwargs.get('text', '')
+'''
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ScriptedResponder:
+    """
+    Answers the agents' requests with fixed, valid responses so a whole loop iteration
+    completes: the agent is recognised from the JSON schema passed in `format`
+    (or the system prompt for the free-text calls).
+
+    responses maps request_key(model, messages, options, format) to a recorded answer;
+    those take precedence over the script.
+    """
+
+    def __init__(self, responses: Optional[dict] = None):
+        self.responses = responses or {}
+
+    def __call__(self, request: dict) -> str:
+        key = request_key(request.get("model"), request.get("messages"), request.get("options"), request.get("format"))
+        if key in self.responses:
+            return self.responses[key]
+
+        schema = request.get("format")
+        properties = {}
+        if isinstance(schema, dict):
+            properties = schema.get("items", schema).get("properties", {})
+        messages = request.get("messages") or []
+        system = messages[0].get("content", "") if messages else ""
+        prompt = "\n".join(message.get("content") or "" for message in messages[1:])
+
+        if "task_description" in properties:
+            return json.dumps({"task_description": "Echo a greeting back to the user",
+                               "success_criteria": "The greeting is returned unchanged"})
+        if "subtask" in properties:
+            plan = [
+                {"subtask": "prepare greeting", "description": "Produce the greeting text",
+                 "success_criteria": "A greeting is returned", "depends_on": []},
+                {"subtask": "echo greeting", "description": "Return the greeting of the previous step",
+                 "success_criteria": "The same greeting is returned", "depends_on": ["prepare greeting"]},
+            ]
+            if "depends_on" not in properties:
+                for subtask in plan:
+                    del subtask["depends_on"]
+            return json.dumps(plan)
+        if "action" in properties:
+            if MOCK_TOOL_NAME in prompt:
+                return json.dumps({"action": "use_tool", "tool_name": MOCK_TOOL_NAME, "tool_args": {"text": "hello"}})
+            return json.dumps({"action": "create_tool", "tool_name": MOCK_TOOL_NAME, "tool_args": {}})
+        if "tool_description" in properties:
+            return json.dumps({"tool_name": MOCK_TOOL_NAME, "tool_description": "Returns the given text unchanged",
+                               "args_description": "text: the text to return"})
+        if "is_correct" in properties:
+            return json.dumps({"report": "The tool returned the expected text.", "is_correct": True})
+        if "Python classes" in system:
+            return f"```python\n{MOCK_TOOL_CODE}```"
+        if "memory aggregator" in system:
+            return "Echoing text works. Next: try a task that needs a new kind of tool."
+        return "OK"
+
+
+class MockOllama:
+    """
+    Local stand-in for the Ollama HTTP API, for benchmarks and offline runs.
+
+    Serves /api/chat (streaming and not), /api/embed, /api/tags and /api/ps.
+    A model counts as loaded (in /api/ps) after its first request until evict() is called.
+    Chat answers come from responder(request) -> str, ScriptedResponder by default.
+    latency is the time to the first token, token_latency the time per streamed chunk
+    of chunk_chars characters, so model speed can be simulated or set to zero.
+    model_latency maps model names to their own time to the first token, e.g. to make a small model faster.
+    """
+
+    def __init__(self, responder: Optional[Callable[[dict], str]] = None, latency: float = 0.0,
+                 token_latency: float = 0.0, chunk_chars: int = 4, embedding_dim: int = 64,
+                 models=("gemma2:2b", "qwen2.5-coder", "nomic-embed-text"), host: str = "127.0.0.1", port: int = 0,
+                 model_latency: Optional[dict] = None):
+        self.responder = responder or ScriptedResponder()
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.token_latency = token_latency
+        self.chunk_chars = chunk_chars
+        self.embedding_dim = embedding_dim
+        self.models = list(models)
+        self.requests = {"chat": 0, "embed": 0, "tags": 0, "ps": 0}
+        self.loaded = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, endpoint: str, model: Optional[str] = None):
+        with self._lock:
+            self.requests[endpoint] += 1
+            if model:
+                self.loaded.add(model)
+
+    def evict(self, model: str):
+        """Unloads a model, like Ollama does when its keep_alive expires."""
+        with self._lock:
+            self.loaded.discard(model)
+
+    def embed(self, text: str) -> list:
+        """Deterministic pseudo-embedding: texts sharing words get similar vectors."""
+        vector = [0.0] * self.embedding_dim
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[digest[0] % self.embedding_dim] += 1.0
+        return vector
+
+    def _model_entry(self, name: str) -> dict:
+        return {"name": name, "model": name, "modified_at": _now(), "size": 1, "digest": hashlib.sha256(name.encode()).hexdigest(),
+                "details": {"format": "gguf", "family": "mock", "parameter_size": "0B", "quantization_level": "none"}}
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    mock._count("tags")
+                    self._send_json({"models": [mock._model_entry(name) for name in mock.models]})
+                elif self.path == "/api/ps":
+                    mock._count("ps")
+                    with mock._lock:
+                        loaded = sorted(mock.loaded)
+                    self._send_json({"models": [{**mock._model_entry(name), "expires_at": _now(), "size_vram": 1}
+                                                for name in loaded]})
+                elif self.path in ("/", "/api/version"):
+                    self._send_json({"version": "0.0.0-mock"})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                if self.path == "/api/chat":
+                    self._chat(self._read_json())
+                elif self.path == "/api/embed":
+                    request = self._read_json()
+                    mock._count("embed", request.get("model"))
+                    texts = request.get("input") or []
+                    if isinstance(texts, str):
+                        texts = [texts]
+                    self._send_json({"model": request.get("model"), "embeddings": [mock.embed(text) for text in texts]})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def _chat(self, request: dict):
+                mock._count("chat", request.get("model"))
+                started_at = time.perf_counter()
+                content = mock.responder(request)
+                prompt_chars = sum(len(message.get("content") or "") for message in request.get("messages") or [])
+                chunks = [content[i:i + mock.chunk_chars] for i in range(0, len(content), mock.chunk_chars)] or [""]
+                latency = mock.model_latency.get(request.get("model"), mock.latency)
+                if latency:
+                    time.sleep(latency)
+                final = {
+                    "model": request.get("model"), "created_at": _now(), "done": True, "done_reason": "stop",
+                    "prompt_eval_count": max(prompt_chars // 4, 1), "eval_count": len(chunks),
+                    "load_duration": 0, "prompt_eval_duration": int(latency * 1e9),
+                }
+                if request.get("stream", True) is False:
+                    if mock.token_latency:
+                        time.sleep(mock.token_latency * len(chunks))
+                    duration = int((time.perf_counter() - started_at) * 1e9)
+                    self._send_json({**final, "message": {"role": "assistant", "content": content},
+                                     "total_duration": duration, "eval_duration": duration - final["prompt_eval_duration"]})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for piece in chunks:
+                        if mock.token_latency:
+                            time.sleep(mock.token_latency)
+                        self._write_chunk({"model": request.get("model"), "created_at": _now(),
+                                           "message": {"role": "assistant", "content": piece}, "done": False})
+                    duration = int((time.perf_counter() - started_at) * 1e9)
+                    self._write_chunk({**final, "message": {"role": "assistant", "content": ""},
+                                       "total_duration": duration, "eval_duration": duration - final["prompt_eval_duration"]})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, e.g. after the first complete JSON value
+                    self.close_connection = True
+
+            def _write_chunk(self, payload: dict):
+                line = (json.dumps(payload) + "\n").encode('utf-8')
+                self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -1,9 +1,24 @@
+import asyncio
 import logging
 from agents.initiator import Initiator
+from memory.episodic import EpisodicMemory
 from agents.planner import Planner
 from agents.actor import Actor
 from agents.critic import Critic
 from toolbox.toolbox import ToolManager
+from toolbox.tool_retriever import ToolRetriever
+from toolbox.executor import ToolExecutor
+from utils.llm_cache import LLMCache
+from utils.artifact_store import ArtifactStore
+from utils.prompt_budget import PromptBudget, budget_stats
+from utils.model_router import ModelRouter
+from utils.model_residency import ModelResidency
+from utils.llm_metrics import configure_metrics, metrics_summary, start_metrics_server
+from utils.tracing import enable_tracing, export_chrome_trace, span
+from utils.ollama_utils import configure_client, configure_llm_cache, configure_session, prefix_cache_stats, retry_stats
+from utils.llm_session import SessionRecorder, SessionReplay
+from orchestration.plan_execution import execute_plan, execute_plan_dag
+from orchestration.pipeline import execute_plan_pipelined
 import json
 
 # Configure logging
@@ -17,79 +32,141 @@ logging.basicConfig(
 )
 
 model = 'qwen2.5-coder'
-tool_manager = ToolManager()
-initiator = Initiator(tool_manager, model=model)
-planner = Planner(tool_manager, model=model)
-actor = Actor(tool_manager, model=model)
-critic = Critic(tool_manager, model=model)
-
-while True:
-    task_info = initiator.generate_task()
+ollama_host = None      # Defaults to $OLLAMA_HOST
+ollama_timeout = None   # Seconds per request, None waits forever
+ollama_keep_alive = -1  # Keeps the models and their prompt caches loaded between calls (-1 until the server stops, or e.g. "30m"),
+                        # None for the server default. Also pins the models loaded by model_residency
+configure_client(host=ollama_host, timeout=ollama_timeout, max_connections=8, keep_alive=ollama_keep_alive)
+embedding_model = 'nomic-embed-text'
+tools_top_k = 10        # How many relevant tools are shown to the agents
+llm_metrics_file = 'llm_metrics.jsonl'  # Per-call latency and token counts of every LLM call
+llm_metrics_port = None                 # e.g. 9464 to serve Prometheus metrics at /metrics
+configure_metrics(jsonl_path=llm_metrics_file)
+if llm_metrics_port is not None and __name__ == "__main__":  # Not in the tool workers, which import this module
+    start_metrics_server(port=llm_metrics_port)
+trace_file = None       # e.g. 'trace.json': Chrome trace / Perfetto timeline of the loop, rewritten after every task
+if trace_file is not None:
+    enable_tracing()
+record_session_file = None   # e.g. 'session.jsonl': record every live LLM call
+replay_session_file = None   # Answer LLM calls from a recorded session instead of the model
+replay_fallback = 'live'     # On a replay miss: 'live' calls the model, 'error' raises
+configure_session(
+    recorder=SessionRecorder(record_session_file) if record_session_file else None,
+    replay=SessionReplay(replay_session_file, fallback=replay_fallback) if replay_session_file else None,
+)
+use_llm_cache = False   # Answer byte-identical LLM requests from llm_cache.sqlite
+if use_llm_cache:
+    configure_llm_cache(LLMCache(disk_path='llm_cache.sqlite'))
+tool_manager = ToolManager(retriever=ToolRetriever(embedding_model=embedding_model), top_k=tools_top_k)
+tool_executor = ToolExecutor(workers=2, timeout=120, cpu_seconds=60, memory_limit_mb=2048)
+# Model of every agent call, unlisted calls use `model`. Short JSON verdicts and decisions can go to a
+# small model and escalate to `model` on a failed parse (escalate_after=1) or a doubtful answer, e.g.
+# {"Critic.evaluate": {"model": "gemma2:2b", "escalate_to": model, "escalate_after": 1}}
+model_routes = {}
+model_router = ModelRouter(model, routes=model_routes)
+warm_up_models = True   # Check the server and load every model before the first iteration, reload evicted ones between iterations
+model_residency = ModelResidency(model_router.models(), embedding_models=[embedding_model],
+                                 keep_alive=ollama_keep_alive)
+# Token budgets of the prompt sections, oversized artifacts are cut to head/tail excerpts
+prompt_budget = PromptBudget(model, budgets={"tools": 1500, "artifacts": 3000, "feedback": 800, "memory": 1500, "plan": 1000})
+use_episodic_memory = True    # Append one episode per iteration to episodic_memory.sqlite instead of rewriting notes.txt
+episodic_memory = EpisodicMemory('episodic_memory.sqlite') if use_episodic_memory else None
+initiator = Initiator(tool_manager, model=model, budget=prompt_budget, episodic_memory=episodic_memory, memory_top_k=5,
+                      summary_fanout=4, summary_words=150, router=model_router)
+plan_with_dependencies = True   # Let the planner emit depends_on edges and run independent subtasks concurrently
+max_parallel_subtasks = 2       # Keep <= OLLAMA_NUM_PARALLEL
+pipeline_subtasks = False       # Without dependencies: decide the next subtask's tool while the critic is running
+planner = Planner(tool_manager, model=model, with_dependencies=plan_with_dependencies, budget=prompt_budget,
+                  router=model_router)
+# Tool outputs above 2000 bytes are written to artifacts/ and passed around as handles with a preview
+artifact_store = ArtifactStore('artifacts', threshold=2000, preview_chars=300)
+actor = Actor(tool_manager, model=model, executor=tool_executor, budget=prompt_budget, artifact_store=artifact_store,
+              router=model_router)
+critic = Critic(tool_manager, model=model, budget=prompt_budget, router=model_router)
+
+max_iterations = 3      # How many times to attempt the entire plan
+max_attempts = 3        # How many times to attempt each subtask
+actor_fanout = 1        # > 1 runs that many diverse actor attempts per round, the first accepted one wins.
+                        # Every attempt runs its tool, so tools with side effects run up to actor_fanout times
+
+
+async def improve_once():
+    """One iteration of self-improvement: generate a task, plan it, execute the plan and conclude."""
+    with span("improve_once"):
+        await _improve_once()
+    if trace_file is not None:
+        export_chrome_trace(trace_file)
+
+
+async def _improve_once():
+    task_info = await initiator.async_generate_task()
     logging.info(f"{"_"*10}Current task{"_"*10}\n{json.dumps(task_info, indent=4)}")
-    plan = planner.create_plan(task_info)
+    plan = await planner.async_create_plan(task_info)
     logging.info(f"{"_"*10}Generated plan{"_"*10}\n{json.dumps(plan, indent=4)}")
 
     clean_artifacts = {}
     full_artifacts = {}
     is_finished = False
 
-    max_iterations = 3      # How many times to attempt the entire plan
-    max_attempts = 3        # How many times to attempt each subtask
-
     for iteration in range(max_iterations):
         logging.info(f"Starting iteration {iteration + 1} for plan execution.")
-        completed_all_subtasks = True  # Assume we’ll complete them until proven otherwise
-
-        for subtask in plan:
-            subtask_key = subtask['subtask']
-            clean_artifacts[subtask_key] = {}
-            full_artifacts[subtask_key] = []
-
-            attempts = 0
-            critic_comment = None
-
-            while attempts < max_attempts:
-                actor_output = actor.perform_subtask(subtask, clean_artifacts, critic_comment)
-                critic_output = critic.evaluate(subtask, actor_output)
-
-                full_artifacts[subtask_key].append({
-                    'completed': critic_output.get("is_correct", False),
-                    'output': actor_output['output'],
-                    'errors': actor_output['errors'],
-                    'critic_report': critic_output['report'],
-                    'chosen_tool': actor_output['chosen_tool'],
-                    'created_tool': actor_output['created_tool']
-                })
-
-                if critic_output.get("is_correct", False):
-                    logging.info(f"Task {subtask_key} completed successfully. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
-                    clean_artifacts[subtask_key] = {
-                        'output': actor_output['output'],
-                        'critic_report': critic_output['report'],
-                        'chosen_tool': actor_output['chosen_tool'],
-                        'created_tool': actor_output['created_tool']
-                    }
-                    break
-                else:
-                    attempts += 1
-                    logging.warning(f"Task {subtask_key} failed on attempt {attempts}. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
-                    critic_comment = critic_output.get("report", None)
-
-            if not clean_artifacts[subtask_key]:
-                logging.error(f"Task {subtask_key} not completed after {max_attempts} attempts.")
-                plan = planner.create_plan(task_info, artifacts=clean_artifacts, previous_plan=plan)
-                logging.info(f"{"_"*10} New generated plan{"_"*10}\n{json.dumps(plan, indent=4)}")
-
-                completed_all_subtasks = False
-                break
-
-        if completed_all_subtasks:
+
+        with span("execute_plan", iteration=iteration + 1):
+            if plan_with_dependencies:
+                failed_subtask = await execute_plan_dag(actor, critic, plan, clean_artifacts, full_artifacts,
+                                                        max_attempts=max_attempts, max_concurrency=max_parallel_subtasks,
+                                                        fanout=actor_fanout)
+            elif pipeline_subtasks:
+                failed_subtask = await execute_plan_pipelined(actor, critic, plan, clean_artifacts, full_artifacts,
+                                                              max_attempts=max_attempts)
+            else:
+                failed_subtask = await execute_plan(actor, critic, plan, clean_artifacts, full_artifacts,
+                                                    max_attempts=max_attempts, fanout=actor_fanout)
+
+        if failed_subtask is None:
             is_finished = True
             break
 
+        plan = await planner.async_create_plan(task_info, artifacts=clean_artifacts, previous_plan=plan)
+        logging.info(f"{"_"*10} New generated plan{"_"*10}\n{json.dumps(plan, indent=4)}")
+
     if is_finished:
         logging.info("All subtasks completed successfully!")
     else:
         logging.error(f"Plan execution failed after {max_iterations} iterations.")
 
-    logging.info(f'New notes.txt\n\n{initiator.conclude(succeeded=is_finished, task_info=task_info, plan=plan, artifacts=full_artifacts)}')
+    new_notes = await initiator.async_conclude(succeeded=is_finished, task_info=task_info, plan=plan, artifacts=full_artifacts)
+    logging.info(f'New notes.txt\n\n{new_notes}')
+    logging.info(f"LLM calls per parse-retry loop: {json.dumps(retry_stats(), indent=4)}")
+    logging.info(f"Prompt prefix shared with the previous call: {json.dumps(prefix_cache_stats(), indent=4)}")
+    logging.info(f"Prompt tokens saved by compaction: {json.dumps(budget_stats(), indent=4)}")
+    logging.info(f"LLM call metrics: {json.dumps(metrics_summary(), indent=4)}")
+    logging.info(f"Escalations to the bigger model: {json.dumps(model_router.stats(), indent=4)}")
+
+
+async def start_models():
+    """
+    Startup phase: health-checks Ollama and loads all models concurrently, pinned with keep_alive.
+    Only the chat models are required, without the embedding model tool retrieval falls back to the full toolbox.
+    """
+    health = await model_residency.async_health_check()
+    missing_chat_models = [name for name in health["missing"] if name not in model_residency.embedding_models]
+    if health["error"] or missing_chat_models:
+        raise SystemExit(f"Ollama isn't ready: {health}")
+    if health["missing"]:
+        logging.warning(f"Embedding model {health['missing']} is missing, tools won't be retrieved by relevance.")
+    await model_residency.async_warm_up([name for name in model_residency.all_models() if name not in health["missing"]])
+
+
+async def main():
+    # A replayed session doesn't need the models
+    if warm_up_models and replay_session_file is None:
+        await start_models()
+    while True:
+        await improve_once()
+        if warm_up_models and replay_session_file is None:
+            model_residency.schedule_rewarm()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(text: str, limit: int = 32) -> List[str]:
+    """Distinct lower-case words of a query, longest first (they're the most specific)."""
+    words = {word.lower() for word in WORD.findall(text or "") if len(word) > 2}
+    return sorted(words, key=lambda word: (-len(word), word))[:limit]
+
+
+class EpisodicMemory:
+    """
+    Append-only long-term memory: one episode per iteration of the loop with its task,
+    plan, outcome and the lessons learned, stored in SQLite.
+
+    search() ranks episodes with an FTS5 full-text index (bm25) when SQLite has it,
+    and with a plain keyword count otherwise, so prompts only get the top-k relevant
+    episodes no matter how many were stored.
+
+    Next to the episodes it keeps a hierarchy of summaries, like the levels of an LSM tree:
+    every episode adds a level-0 entry, and once a level has `fanout` pending entries they're
+    rolled up into one entry of the next level (see Initiator._compact_memory). Rolled-up
+    entries stay on disk, only the pending ones make up the current memory.
+    """
+
+    def __init__(self, db_path: str = "episodic_memory.sqlite"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS episodes ("
+            "id INTEGER PRIMARY KEY, created REAL NOT NULL, task TEXT NOT NULL, plan TEXT NOT NULL, "
+            "succeeded INTEGER NOT NULL, outcome TEXT NOT NULL, lessons TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "id INTEGER PRIMARY KEY, level INTEGER NOT NULL, created REAL NOT NULL, first_episode INTEGER NOT NULL, "
+            "last_episode INTEGER NOT NULL, text TEXT NOT NULL, merged_into INTEGER)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS summaries_pending ON summaries (level, merged_into, id)")
+        self.fts = self._create_fts()
+        self._db.commit()
+
+    def _create_fts(self) -> bool:
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS episodes_fts USING fts5("
+                "task, outcome, lessons, content='episodes', content_rowid='id')"
+            )
+            self._db.execute(
+                "CREATE TRIGGER IF NOT EXISTS episodes_fts_insert AFTER INSERT ON episodes BEGIN "
+                "INSERT INTO episodes_fts (rowid, task, outcome, lessons) VALUES (new.id, new.task, new.outcome, new.lessons); "
+                "END"
+            )
+            return True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5
+            return False
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+
+    def add(self, task: str, plan, succeeded: bool, outcome: str, lessons: str) -> int:
+        """Appends an episode and returns its id."""
+        if not isinstance(plan, str):
+            plan = json.dumps(plan, ensure_ascii=False, default=str)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO episodes (created, task, plan, succeeded, outcome, lessons) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), task, plan, int(bool(succeeded)), outcome, lessons),
+            )
+            episode_id = cursor.lastrowid
+            self._db.execute(
+                "INSERT INTO summaries (level, created, first_episode, last_episode, text) VALUES (0, ?, ?, ?, ?)",
+                (time.time(), episode_id, episode_id,
+                 f"{task} ({'succeeded' if succeeded else 'failed'}): {lessons}"),
+            )
+            self._db.commit()
+            return episode_id
+
+    @staticmethod
+    def _episode(row) -> dict:
+        return {"id": row[0], "created": row[1], "task": row[2], "plan": row[3],
+                "succeeded": bool(row[4]), "outcome": row[5], "lessons": row[6]}
+
+    def get(self, episode_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM episodes WHERE id = ?", (episode_id,)).fetchone()
+        return self._episode(row) if row else None
+
+    def recent(self, k: int = 5) -> List[dict]:
+        """The k latest episodes, newest first."""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM episodes ORDER BY id DESC LIMIT ?", (k,)).fetchall()
+        return [self._episode(row) for row in rows]
+
+    def search(self, query: str, k: int = 5) -> List[dict]:
+        """The k episodes most relevant to the query, best first."""
+        terms = _terms(query)
+        if not terms or k <= 0:
+            return []
+        with self._lock:
+            if self.fts:
+                match = " OR ".join(f'"{term}"' for term in terms)
+                rows = self._db.execute(
+                    "SELECT episodes.* FROM episodes_fts JOIN episodes ON episodes.id = episodes_fts.rowid "
+                    "WHERE episodes_fts MATCH ? ORDER BY bm25(episodes_fts) LIMIT ?",
+                    (match, k),
+                ).fetchall()
+            else:
+                # Score by the number of query terms an episode contains
+                score = " + ".join("(instr(lower(task || ' ' || outcome || ' ' || lessons), ?) > 0)" for _ in terms)
+                rows = self._db.execute(
+                    f"SELECT *, ({score}) AS score FROM episodes WHERE score > 0 ORDER BY score DESC, id DESC LIMIT ?",
+                    (*terms, k),
+                ).fetchall()
+                rows = [row[:-1] for row in rows]
+        return [self._episode(row) for row in rows]
+
+    def relevant(self, query: str, k: int = 5, recent: int = 2) -> List[dict]:
+        """
+        Up to k episodes for a prompt: the `recent` latest ones (so the newest lessons are
+        never missed) followed by the best search() hits for the query.
+        """
+        episodes = {episode["id"]: episode for episode in self.recent(min(recent, k))}
+        for episode in self.search(query, k):
+            if len(episodes) >= k:
+                break
+            episodes.setdefault(episode["id"], episode)
+        return list(episodes.values())
+
+    @staticmethod
+    def _summary(row) -> dict:
+        return {"id": row[0], "level": row[1], "created": row[2], "first_episode": row[3],
+                "last_episode": row[4], "text": row[5]}
+
+    def pending_summaries(self, level: int, limit: int = -1) -> List[dict]:
+        """Entries of a level that weren't rolled up yet, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, level, created, first_episode, last_episode, text FROM summaries "
+                "WHERE level = ? AND merged_into IS NULL ORDER BY id LIMIT ?",
+                (level, limit),
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def add_summary(self, level: int, sources: List[dict], text: str) -> int:
+        """Stores the roll-up of sources (entries of level - 1) as a new entry of level and marks them merged."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO summaries (level, created, first_episode, last_episode, text) VALUES (?, ?, ?, ?, ?)",
+                (level, time.time(), min(source["first_episode"] for source in sources),
+                 max(source["last_episode"] for source in sources), text),
+            )
+            summary_id = cursor.lastrowid
+            self._db.executemany("UPDATE summaries SET merged_into = ? WHERE id = ?",
+                                 [(summary_id, source["id"]) for source in sources])
+            self._db.commit()
+            return summary_id
+
+    def memory_summaries(self, min_level: int = 1) -> List[dict]:
+        """
+        The current summarised memory: all pending entries from min_level up, oldest history
+        (highest level) first. At most fanout - 1 entries per level, so its size only grows
+        with the logarithm of the number of episodes.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, level, created, first_episode, last_episode, text FROM summaries "
+                "WHERE level >= ? AND merged_into IS NULL ORDER BY level DESC, id",
+                (min_level,),
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def format_episodes(episodes: List[dict]) -> str:
+    """Compact text form of episodes for prompts."""
+    if not episodes:
+        return "No previous iterations yet."
+    return "\n".join(
+        f"- #{episode['id']} {'succeeded' if episode['succeeded'] else 'failed'}: {episode['task']}\n"
+        f"  Lessons: {episode['lessons']}"
+        for episode in episodes
+    )
+
+
+def format_summaries(summaries: List[dict]) -> str:
+    """Compact text form of summary entries for prompts."""
+    if not summaries:
+        return "No summarised history yet."
+    return "\n".join(
+        f"- Iterations #{summary['first_episode']}-#{summary['last_episode']}: {summary['text']}"
+        for summary in summaries
+    )
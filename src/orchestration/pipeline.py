@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+from typing import List, Optional
+from utils.llm_metrics import llm_call_tags
+
+logger = logging.getLogger(__name__)
+
+
+def actor_view(clean_artifacts: dict) -> dict:
+    """
+    The part of the accepted artifacts the actor sees in pipelined mode.
+    Critic reports are left out: they are only known after the critique, and the next
+    subtask's decision has to be computable while the critique is still running.
+    """
+    return {
+        name: {key: artifact[key] for key in ('output', 'chosen_tool', 'created_tool') if key in artifact}
+        for name, artifact in clean_artifacts.items()
+    }
+
+
+async def _cancel(task):
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+async def execute_plan_pipelined(actor, critic, plan: List[dict], clean_artifacts: dict, full_artifacts: dict,
+                                 max_attempts: int = 3) -> Optional[str]:
+    """
+    Runs the subtasks of the plan in order like execute_plan, but overlaps the stages:
+    while the critic evaluates subtask i, the actor's tool decision for subtask i+1 is
+    computed speculatively, assuming subtask i will be accepted.
+
+    The speculation is dropped if the critic rejects subtask i, and it is only used by the
+    actor if the decision prompt turned out to be exactly the same (same artifacts, same
+    relevant tools), so the results match the sequential execution.
+    clean_artifacts and full_artifacts are filled in place.
+    Returns the name of the subtask that failed, or None if all of them were completed.
+    """
+    speculation = None
+    hits = 0
+    misses = 0
+    try:
+        for index, subtask in enumerate(plan):
+            subtask_key = subtask['subtask']
+            next_subtask = plan[index + 1] if index + 1 < len(plan) else None
+            clean_artifacts[subtask_key] = {}
+            full_artifacts[subtask_key] = attempts = []
+            critic_comment = None
+
+            with llm_call_tags(subtask=subtask_key):
+                while len(attempts) < max_attempts:
+                    artifacts = actor_view(clean_artifacts)
+                    ahead = None
+                    if speculation is not None:
+                        try:
+                            ahead = await speculation
+                        except Exception as e:
+                            logger.warning(f"Speculative decision for {subtask_key} failed, recomputing it: {e}")
+                        speculation = None
+                    actor_output = await actor.async_perform_subtask(subtask, artifacts, critic_comment, speculation=ahead)
+                    if ahead is not None:
+                        if ahead.get('used'):
+                            hits += 1
+                        else:
+                            misses += 1
+
+                    if next_subtask is not None:
+                        assumed = {**artifacts, subtask_key: actor_view({subtask_key: actor_output})[subtask_key]}
+                        with llm_call_tags(subtask=next_subtask['subtask']):
+                            speculation = asyncio.create_task(actor.async_decide(next_subtask, assumed))
+                    critic_output = await critic.async_evaluate(subtask, actor_output)
+
+                    attempts.append({
+                        'completed': critic_output.get("is_correct", False),
+                        'output': actor_output['output'],
+                        'errors': actor_output['errors'],
+                        'critic_report': critic_output['report'],
+                        'chosen_tool': actor_output['chosen_tool'],
+                        'created_tool': actor_output['created_tool']
+                    })
+
+                    if critic_output.get("is_correct", False):
+                        logger.info(f"Task {subtask_key} completed successfully. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
+                        clean_artifacts[subtask_key] = {
+                            'output': actor_output['output'],
+                            'critic_report': critic_output['report'],
+                            'chosen_tool': actor_output['chosen_tool'],
+                            'created_tool': actor_output['created_tool']
+                        }
+                        break
+
+                    logger.warning(f"Task {subtask_key} failed on attempt {len(attempts)}. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
+                    critic_comment = critic_output.get("report", None)
+                    await _cancel(speculation)
+                    speculation = None
+
+            if not clean_artifacts[subtask_key]:
+                logger.error(f"Task {subtask_key} not completed after {max_attempts} attempts.")
+                return subtask_key
+        return None
+    finally:
+        await _cancel(speculation)
+        logger.info(f"Pipelined decisions: {hits} reused, {misses} recomputed.")
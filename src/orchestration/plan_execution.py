@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+from utils.llm_metrics import llm_call_tags
+from .speculative import run_subtask_speculative
+
+logger = logging.getLogger(__name__)
+
+
+async def run_subtask(actor, critic, subtask: dict, artifacts, max_attempts: int = 3, fanout: int = 1):
+    """
+    Runs actor -> critic rounds for one subtask until the critic accepts the result
+    or max_attempts is reached. With fanout > 1 each round runs that many diverse
+    attempts in parallel, see run_subtask_speculative.
+
+    Returns (clean_artifact, attempts): clean_artifact is the accepted result
+    ({} if the subtask failed), attempts holds every round for the logs.
+    """
+    # LLM calls of the subtask are tagged with its name in the metrics
+    with llm_call_tags(subtask=subtask['subtask']):
+        if fanout > 1:
+            return await run_subtask_speculative(actor, critic, subtask, artifacts, max_attempts, fanout)
+        return await _run_rounds(actor, critic, subtask, artifacts, max_attempts)
+
+
+async def _run_rounds(actor, critic, subtask: dict, artifacts, max_attempts: int):
+    subtask_key = subtask['subtask']
+    attempts = []
+    critic_comment = None
+
+    while len(attempts) < max_attempts:
+        actor_output = await actor.async_perform_subtask(subtask, artifacts, critic_comment)
+        critic_output = await critic.async_evaluate(subtask, actor_output)
+
+        attempts.append({
+            'completed': critic_output.get("is_correct", False),
+            'output': actor_output['output'],
+            'errors': actor_output['errors'],
+            'critic_report': critic_output['report'],
+            'chosen_tool': actor_output['chosen_tool'],
+            'created_tool': actor_output['created_tool']
+        })
+
+        if critic_output.get("is_correct", False):
+            logger.info(f"Task {subtask_key} completed successfully. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
+            clean_artifact = {
+                'output': actor_output['output'],
+                'critic_report': critic_output['report'],
+                'chosen_tool': actor_output['chosen_tool'],
+                'created_tool': actor_output['created_tool']
+            }
+            return clean_artifact, attempts
+
+        logger.warning(f"Task {subtask_key} failed on attempt {len(attempts)}. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
+        critic_comment = critic_output.get("report", None)
+
+    logger.error(f"Task {subtask_key} not completed after {max_attempts} attempts.")
+    return {}, attempts
+
+
+async def execute_plan(actor, critic, plan: List[dict], clean_artifacts: dict, full_artifacts: dict,
+                       max_attempts: int = 3, fanout: int = 1) -> Optional[str]:
+    """
+    Runs the subtasks of the plan one after another; each one sees the artifacts of all previous ones.
+    clean_artifacts and full_artifacts are filled in place.
+    Returns the name of the subtask that failed, or None if all of them were completed.
+    """
+    for subtask in plan:
+        subtask_key = subtask['subtask']
+        clean_artifacts[subtask_key] = {}
+        clean_artifact, attempts = await run_subtask(actor, critic, subtask, clean_artifacts, max_attempts, fanout)
+        clean_artifacts[subtask_key] = clean_artifact
+        full_artifacts[subtask_key] = attempts
+        if not clean_artifact:
+            return subtask_key
+    return None
+
+
+def plan_dependencies(plan: List[dict], done=()) -> Dict[str, List[str]]:
+    """
+    Returns the validated dependency edges {subtask: [subtasks it depends on]} of a plan.
+    done are subtasks accepted earlier, e.g. under the plan before a replan: edges to them
+    are kept (they're already satisfied). Other unknown names and self-references are dropped.
+    If the edges contain a cycle, the plan falls back to sequential order (each subtask
+    depends on the previous one).
+    """
+    names = [subtask['subtask'] for subtask in plan]
+    known = set(names) | set(done)
+    dependencies = {}
+    for subtask in plan:
+        depends_on = subtask.get('depends_on') or []
+        if not isinstance(depends_on, list):
+            depends_on = [depends_on]
+        dependencies[subtask['subtask']] = [
+            name for name in dict.fromkeys(depends_on) if name in known and name != subtask['subtask']
+        ]
+
+    # Kahn's algorithm: every subtask must become ready at some point
+    remaining = {name: set(deps) & set(names) for name, deps in dependencies.items()}
+    while True:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            break
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    if remaining:
+        logger.warning(f"Plan dependencies contain a cycle between {sorted(remaining)}, running sequentially.")
+        return {name: names[i - 1:i] for i, name in enumerate(names)}
+    return dependencies
+
+
+async def execute_plan_dag(actor, critic, plan: List[dict], clean_artifacts: dict, full_artifacts: dict,
+                           max_attempts: int = 3, max_concurrency: int = 2, fanout: int = 1) -> Optional[str]:
+    """
+    Runs the plan as a DAG built from the subtasks' "depends_on" edges.
+
+    A subtask starts as soon as all of its dependencies were accepted by the critic,
+    with at most max_concurrency actor/critic cycles running at once. Each subtask only
+    sees the artifacts of its direct dependencies. Subtasks accepted before a replan
+    (a non-empty entry in clean_artifacts but not in the plan) count as completed.
+    After a failure no new subtasks are started, the running ones are allowed to finish.
+    If a subtask raises, the running ones are cancelled and the error is re-raised.
+    Edges name their subtasks, so a plan with repeated subtask names (e.g. two "Test the
+    script" steps) can't be scheduled as a DAG and runs sequentially with execute_plan.
+    clean_artifacts and full_artifacts are filled in place.
+    Returns the name of the first subtask that failed, or None if all of them were completed.
+    """
+    names = [subtask['subtask'] for subtask in plan]
+    if len(set(names)) < len(names):
+        logger.warning(f"Plan has repeated subtask names, running sequentially: {names}")
+        return await execute_plan(actor, critic, plan, clean_artifacts, full_artifacts, max_attempts, fanout)
+
+    pending = {subtask['subtask']: subtask for subtask in plan}
+    completed = {name for name, artifact in clean_artifacts.items() if artifact and name not in pending}
+    dependencies = plan_dependencies(plan, done=completed)
+    running = {}
+    failed_subtask = None
+
+    try:
+        while pending or running:
+            if failed_subtask is None:
+                ready = [name for name in pending if all(dep in completed for dep in dependencies[name])]
+                for name in ready[:max_concurrency - len(running)]:
+                    subtask = pending.pop(name)
+                    artifacts = {dep: clean_artifacts[dep] for dep in dependencies[name]}
+                    clean_artifacts[name] = {}
+                    task = asyncio.create_task(run_subtask(actor, critic, subtask, artifacts, max_attempts, fanout))
+                    running[task] = name
+            if not running:
+                break
+
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                name = running.pop(task)
+                clean_artifact, attempts = task.result()
+                clean_artifacts[name] = clean_artifact
+                full_artifacts[name] = attempts
+                if clean_artifact:
+                    completed.add(name)
+                elif failed_subtask is None:
+                    failed_subtask = name
+    except BaseException:
+        # Don't leave the other subtasks running unobserved
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+    return failed_subtask
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+from typing import Sequence
+
+logger = logging.getLogger(__name__)
+
+# Sampling temperatures of the parallel attempts, cycled if the fan-out is larger
+DEFAULT_TEMPERATURES = (0.2, 0.7, 1.0)
+
+
+# Followed by the attempt's index in the names of the tools it creates, so parallel attempts that
+# design the same tool don't collide
+ATTEMPT_SUFFIX = "_attempt"
+
+
+async def _attempt(actor, critic, subtask: dict, artifacts, critic_comment, options: dict, progress: dict,
+                   tool_name_suffix: str):
+    """
+    One actor -> critic round. Errors count as a rejected attempt instead of failing the whole round.
+    progress is the actor's result dict, filled in place even if the attempt gets cancelled.
+    """
+    try:
+        actor_output = await actor.async_perform_subtask(subtask, artifacts, critic_comment, options=options,
+                                                         result=progress, tool_name_suffix=tool_name_suffix)
+        critic_output = await critic.async_evaluate(subtask, actor_output)
+    except Exception as e:
+        logger.warning(f"Speculative attempt with {options} failed: {e}")
+        actor_output = {'output': None, 'errors': str(e), 'chosen_tool': None, 'created_tool': None}
+        critic_output = {'is_correct': False, 'report': f"Attempt failed with an error: {e}"}
+    return actor_output, critic_output
+
+
+async def _discard_created_tools(tool_manager, progresses, accepted: dict = None):
+    """
+    Deletes the tools created by attempts that weren't accepted: cancelled attempts never
+    reach the critic, which deletes a rejected created tool only if it was also the chosen one.
+    """
+    keep = {accepted.get('created_tool'), accepted.get('chosen_tool')} if accepted else set()
+    for progress in progresses:
+        created_tool = progress.get('created_tool')
+        if created_tool and created_tool not in keep:
+            if await asyncio.to_thread(tool_manager.delete_tool, created_tool):
+                logger.info(f"Deleted tool {created_tool} of an attempt that wasn't accepted.")
+
+
+async def _keep_accepted_tool(tool_manager, accepted: dict):
+    """Renames the tool created by the accepted attempt to the name it was designed with, if that's free."""
+    name, suffix, index = (accepted.get('created_tool') or "").rpartition(ATTEMPT_SUFFIX)
+    if not suffix or not name or not index.isdigit():
+        return
+    created_tool = accepted['created_tool']
+    if await asyncio.to_thread(tool_manager.rename_tool, created_tool, name):
+        accepted['created_tool'] = name
+        if accepted.get('chosen_tool') == created_tool:
+            accepted['chosen_tool'] = name
+
+
+async def run_subtask_speculative(actor, critic, subtask: dict, artifacts, max_attempts: int = 3, fanout: int = 3,
+                                  temperatures: Sequence[float] = DEFAULT_TEMPERATURES):
+    """
+    Speculative version of run_subtask: every round launches `fanout` actor attempts at once,
+    each with its own temperature and seed. Critics evaluate the attempts as they finish,
+    and the remaining ones are cancelled as soon as one is accepted.
+    A rejected round passes its first critic report to the next one, up to max_attempts rounds.
+    Attempts that create a tool save it under their own name (ATTEMPT_SUFFIX), so each of them
+    is a real candidate; the accepted one is renamed to the designed name afterwards, the others
+    are deleted. Cancelling an attempt doesn't stop a tool that is already running (in a thread
+    or the executor), so every attempt may run its tool once.
+
+    Returns (clean_artifact, attempts) like run_subtask.
+    """
+    subtask_key = subtask['subtask']
+    attempts = []
+    critic_comment = None
+
+    for round_index in range(max_attempts):
+        tasks = []
+        progresses = []
+        for i in range(fanout):
+            options = {"temperature": temperatures[i % len(temperatures)], "seed": round_index * fanout + i}
+            progresses.append({})
+            tasks.append(asyncio.create_task(_attempt(actor, critic, subtask, artifacts, critic_comment, options,
+                                                      progresses[-1], f"{ATTEMPT_SUFFIX}{i}")))
+
+        round_comment = None
+        accepted = None
+        try:
+            for finished in asyncio.as_completed(tasks):
+                actor_output, critic_output = await finished
+                attempts.append({
+                    'completed': critic_output.get("is_correct", False),
+                    'output': actor_output['output'],
+                    'errors': actor_output['errors'],
+                    'critic_report': critic_output['report'],
+                    'chosen_tool': actor_output['chosen_tool'],
+                    'created_tool': actor_output['created_tool']
+                })
+                if critic_output.get("is_correct", False):
+                    logger.info(f"Task {subtask_key} completed successfully in round {round_index + 1} "
+                                f"after {len(attempts)} attempts. Critic Report:\n {json.dumps(critic_output['report'], indent=4)}")
+                    accepted = {
+                        'output': actor_output['output'],
+                        'critic_report': critic_output['report'],
+                        'chosen_tool': actor_output['chosen_tool'],
+                        'created_tool': actor_output['created_tool']
+                    }
+                    return accepted, attempts
+                if round_comment is None:
+                    round_comment = critic_output.get("report", None)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await _discard_created_tools(actor.tool_manager, progresses, accepted)
+            if accepted is not None:
+                await _keep_accepted_tool(actor.tool_manager, accepted)
+
+        logger.warning(f"Task {subtask_key} failed in round {round_index + 1} ({fanout} attempts).")
+        critic_comment = round_comment
+
+    logger.error(f"Task {subtask_key} not completed after {max_attempts} rounds of {fanout} attempts.")
+    return {}, attempts
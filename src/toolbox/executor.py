@@ -0,0 +1,192 @@
+import importlib.util
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import traceback
+from typing import Optional
+from .base_tool import Tool
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: run without resource limits
+    resource = None
+
+# Outcome statuses of ToolExecutor.run
+STATUS_SUCCESS = "success"
+STATUS_ERROR = "error"      # The tool raised an exception
+STATUS_TIMEOUT = "timeout"  # Wall-clock timeout, the worker was killed
+STATUS_CRASH = "crash"      # The worker died: CPU limit, segfault, os._exit, ...
+
+TRUNCATION_MARKER = "\n...[output truncated]"
+
+# Workers are started from a clean server process where available, see ToolExecutor
+DEFAULT_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + TRUNCATION_MARKER
+
+
+def _limit_output(output, max_chars: int):
+    """Keeps small picklable outputs as they are, anything else is turned into a bounded string."""
+    if isinstance(output, str):
+        return _truncate(output, max_chars)
+    try:
+        if len(pickle.dumps(output)) <= max_chars:
+            return output
+    except Exception:
+        pass
+    return _truncate(str(output), max_chars)
+
+
+def _load_tool_class(py_path: str, cache: dict):
+    """Imports a tool file inside the worker, once per file version."""
+    stat = os.stat(py_path)
+    key = (py_path, stat.st_mtime_ns, stat.st_size)
+    if key not in cache:
+        module_name = os.path.splitext(os.path.basename(py_path))[0]
+        spec = importlib.util.spec_from_file_location(module_name, py_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)  # type: ignore
+        tool_class = None
+        for attr_name in dir(module):
+            attr = getattr(module, attr_name)
+            if isinstance(attr, type) and issubclass(attr, Tool) and attr is not Tool:
+                tool_class = attr
+                break
+        cache[key] = tool_class
+    return cache[key]
+
+
+def _worker_main(conn, memory_limit: Optional[int]):
+    """Worker loop: receives (py_path, tool_args, cpu_seconds, max_output_chars) and sends back an outcome."""
+    if resource is not None and memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    tool_classes = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        py_path, tool_args, cpu_seconds, max_output_chars = request
+        if resource is not None and cpu_seconds:
+            # RLIMIT_CPU counts the whole process lifetime, so the limit is relative to what was used so far
+            used = resource.getrusage(resource.RUSAGE_SELF)
+            used_seconds = int(used.ru_utime + used.ru_stime) + 1
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+            soft = used_seconds + cpu_seconds
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        try:
+            tool_class = _load_tool_class(py_path, tool_classes)
+            if tool_class is None:
+                raise ValueError(f"No valid Tool class found in {py_path}.")
+            output = tool_class().run(**tool_args)
+            outcome = (STATUS_SUCCESS, _limit_output(output, max_output_chars), None)
+        except BaseException as e:
+            error = _truncate(f"{type(e).__name__}: {e}\n{traceback.format_exc()}", max_output_chars)
+            outcome = (STATUS_ERROR, None, error)
+        conn.send(outcome)
+
+
+class _Worker:
+    def __init__(self, context, memory_limit):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ToolExecutor:
+    """
+    Runs generated tools in a pool of worker processes.
+
+    Each call gets a wall-clock timeout and a CPU time budget, workers run under an
+    address-space limit, and outputs are truncated to max_output_chars.
+    A worker that times out or dies is replaced, so a broken tool can't stall or kill
+    the main loop. run() returns a structured outcome:
+    {"status": "success" | "error" | "timeout" | "crash", "output": ..., "error": ..., "duration": seconds}
+
+    Workers are started lazily and replaced after a timeout or crash, from whatever thread
+    calls run() while the event loop, the Ollama client and logging are busy in other threads.
+    Don't use start_method="fork" then: a lock another thread holds at fork time (logging,
+    utils.ollama_utils, utils.llm_metrics) stays locked in the worker, and a tool that calls
+    the LLM deadlocks until the timeout. The default "forkserver" forks workers from a separate
+    single-threaded server ("spawn" where it isn't available). Like any such multiprocessing
+    child, a worker imports the main module as __mp_main__, so side effects of the main module
+    that mustn't run again (e.g. binding a port) belong under `if __name__ == "__main__"`.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 120, cpu_seconds: int = 60,
+                 memory_limit_mb: Optional[int] = 2048, max_output_chars: int = 20000,
+                 start_method: str = DEFAULT_START_METHOD):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self.max_output_chars = max_output_chars
+        self._context = multiprocessing.get_context(start_method)
+        self._workers = workers
+        self._idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if not self._started:
+                for _ in range(self._workers):
+                    self._idle.put(_Worker(self._context, self.memory_limit))
+                self._started = True
+
+    def run(self, py_path: str, tool_args: dict) -> dict:
+        """Runs the tool defined in py_path with tool_args in a worker and waits for the outcome."""
+        self._start()
+        worker = self._idle.get()
+        started_at = time.perf_counter()
+        try:
+            worker.conn.send((py_path, tool_args, self.cpu_seconds, self.max_output_chars))
+            if worker.conn.poll(self.timeout):
+                status, output, error = worker.conn.recv()
+            else:
+                status, output, error = STATUS_TIMEOUT, None, f"Tool didn't finish within {self.timeout} seconds."
+        except (EOFError, OSError):
+            worker.process.join(timeout=1)
+            exitcode = worker.process.exitcode
+            status, output, error = STATUS_CRASH, None, f"Tool process died (exit code {exitcode})."
+        except Exception as e:
+            # e.g. tool_args that can't be pickled
+            status, output, error = STATUS_ERROR, None, str(e)
+        finally:
+            duration = time.perf_counter() - started_at
+        if status in (STATUS_TIMEOUT, STATUS_CRASH):
+            worker.kill()
+            worker = _Worker(self._context, self.memory_limit)
+        self._idle.put(worker)
+        return {"status": status, "output": output, "error": error, "duration": duration}
+
+    def shutdown(self):
+        """Stops all idle workers."""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.kill()
+        self._started = False
@@ -0,0 +1,158 @@
+import ast
+import importlib.util
+import io
+import re
+import tokenize
+from typing import Iterator, List
+from toolbox.tool_metadata import _is_tool_subclass
+
+# Lines of the example tool in Actor._generate_tool_code that models copy instead of writing code,
+# matched in the code and its comments but not in strings
+PLACEHOLDER_PATTERN = re.compile(r"here you need to implement|implement (the )?full logic|your code here",
+                                 re.IGNORECASE)
+
+
+def _module_exists(name: str) -> bool:
+    """True if the top-level package of an absolute import can be found, without importing it."""
+    try:
+        return importlib.util.find_spec(name.split(".")[0]) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# Exceptions whose handler makes an import optional
+IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError", "Exception", "BaseException"}
+
+
+def _handles_import_error(handler: ast.ExceptHandler) -> bool:
+    if handler.type is None:
+        return True
+    types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(exc, ast.Name) and exc.id in IMPORT_ERRORS for exc in types)
+
+
+def _module_level_imports(statements: List[ast.stmt]) -> Iterator[ast.stmt]:
+    """
+    Imports that run when the module is loaded. Imports inside functions and the body
+    of a try with an ImportError handler are optional and skipped.
+    """
+    for statement in statements:
+        if isinstance(statement, (ast.Import, ast.ImportFrom)):
+            yield statement
+        elif isinstance(statement, ast.Try):
+            if not any(_handles_import_error(handler) for handler in statement.handlers):
+                yield from _module_level_imports(statement.body)
+            for handler in statement.handlers:
+                yield from _module_level_imports(handler.body)
+            yield from _module_level_imports(statement.orelse)
+            yield from _module_level_imports(statement.finalbody)
+        elif isinstance(statement, (ast.If, ast.With)):
+            yield from _module_level_imports(statement.body)
+            yield from _module_level_imports(getattr(statement, "orelse", []))
+
+
+def _unresolved_imports(tree: ast.Module) -> List[str]:
+    missing = []
+    for node in _module_level_imports(tree.body):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            names = [node.module]
+        else:
+            continue
+        missing.extend(name for name in names if name not in missing and not _module_exists(name))
+    return missing
+
+
+def _is_placeholder_body(function: ast.FunctionDef) -> bool:
+    """True if the function only has a docstring, pass, ... or raise NotImplementedError."""
+    for statement in function.body:
+        if isinstance(statement, ast.Pass):
+            continue
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+            continue
+        if isinstance(statement, ast.Raise) and statement.exc is not None:
+            exc = statement.exc.func if isinstance(statement.exc, ast.Call) else statement.exc
+            if isinstance(exc, ast.Name) and exc.id == "NotImplementedError":
+                continue
+        return False
+    return True
+
+
+def _is_example_stub(function: ast.FunctionDef) -> bool:
+    """
+    True if the function is the run method of the example tool with the placeholder line dropped:
+    it only reads kwargs and returns an f-string starting with "Processed".
+    """
+    stub = False
+    for statement in function.body:
+        if isinstance(statement, ast.Pass) or (isinstance(statement, ast.Expr)
+                                               and isinstance(statement.value, ast.Constant)):
+            continue
+        if isinstance(statement, ast.Assign):
+            value = statement.value
+        elif isinstance(statement, ast.Return):
+            value = statement.value
+        else:
+            return False
+        if isinstance(value, ast.JoinedStr):
+            first = value.values[0] if value.values else None
+            stub = stub or (isinstance(first, ast.Constant) and str(first.value).startswith("Processed"))
+        elif not (isinstance(value, (ast.Name, ast.Constant))
+                  or (isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute)
+                      and isinstance(value.func.value, ast.Name) and value.func.value.id == "kwargs")):
+            return False
+    return stub
+
+
+def _find_placeholder(source: str):
+    """(line, text) of the first placeholder in the code or a comment, or None. Strings are skipped."""
+    lines = {}
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type in (tokenize.NAME, tokenize.OP, tokenize.NUMBER, tokenize.COMMENT):
+            lines.setdefault(token.start[0], []).append(token.string)
+    for line, words in sorted(lines.items()):
+        placeholder = PLACEHOLDER_PATTERN.search(" ".join(words))
+        if placeholder:
+            return line, placeholder.group(0)
+    return None
+
+
+def check_tool_code(source: str) -> List[str]:
+    """
+    Static checks of a tool's source code, without running it: syntax, module-level imports that can't
+    be resolved, a Tool subclass with a run method, input() calls (tools run unattended)
+    and placeholder code left over from the example tool.
+    Returns the problems found, an empty list if the code passes.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError) as e:
+        return [f"Syntax error: {e}"]
+
+    problems = []
+    missing = _unresolved_imports(tree)
+    if missing:
+        problems.append(f"Imports that can't be resolved: {', '.join(missing)}")
+
+    tool_classes = [node for node in tree.body if isinstance(node, ast.ClassDef) and _is_tool_subclass(node)]
+    if not tool_classes:
+        problems.append("No class deriving from Tool.")
+    else:
+        run = next((item for item in tool_classes[0].body
+                    if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name == "run"), None)
+        if run is None:
+            problems.append(f"{tool_classes[0].name} has no run method.")
+        elif _is_placeholder_body(run):
+            problems.append(f"{tool_classes[0].name}.run is not implemented.")
+        elif _is_example_stub(run):
+            problems.append(f"{tool_classes[0].name}.run is the example tool's stub, not an implementation.")
+
+    if any(isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "input"
+           for node in ast.walk(tree)):
+        problems.append("Calls input(), tools must take arguments instead.")
+
+    placeholder = _find_placeholder(source)
+    if placeholder:
+        problems.append(f"Placeholder left in the code at line {placeholder[0]}: {placeholder[1]!r}")
+    return problems
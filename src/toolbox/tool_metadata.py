@@ -0,0 +1,108 @@
+import ast
+from typing import Optional
+
+# Properties of the Tool interface that make up a tool's description
+METADATA_FIELDS = ("tool_desc", "param_desc")
+
+
+def _constant_string(node) -> Optional[str]:
+    """
+    Returns the value of node if it is a string known without running code:
+    a string literal, an f-string without placeholders or a concatenation of those.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = [_constant_string(value) for value in node.values]
+        if all(part is not None for part in parts):
+            return "".join(parts)
+        return None
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _constant_string(node.left), _constant_string(node.right)
+        if left is not None and right is not None:
+            return left + right
+    return None
+
+
+def _property_value(node) -> Optional[str]:
+    """
+    Returns the constant value of a tool_desc/param_desc definition:
+    either a property whose body is only `return "..."` or a plain class attribute.
+    """
+    if isinstance(node, ast.FunctionDef):
+        body = node.body
+        # Skip a leading docstring
+        if len(body) > 1 and isinstance(body[0], ast.Expr) and _constant_string(body[0].value) is not None:
+            body = body[1:]
+        if len(body) == 1 and isinstance(body[0], ast.Return) and body[0].value is not None:
+            return _constant_string(body[0].value)
+        return None
+    if isinstance(node, ast.Assign):
+        return _constant_string(node.value)
+    if isinstance(node, ast.AnnAssign) and node.value is not None:
+        return _constant_string(node.value)
+    return None
+
+
+def _defined_name(node) -> Optional[str]:
+    if isinstance(node, ast.FunctionDef):
+        return node.name
+    if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+        return node.targets[0].id
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return node.target.id
+    return None
+
+
+def _is_tool_subclass(node: ast.ClassDef) -> bool:
+    for base in node.bases:
+        if isinstance(base, ast.Name) and base.id == "Tool":
+            return True
+        if isinstance(base, ast.Attribute) and base.attr == "Tool":
+            return True
+    return False
+
+
+def extract_tool_metadata(source: str) -> Optional[dict]:
+    """
+    Reads the description of a tool from its source code without importing it.
+
+    Looks for the first class deriving directly from Tool and returns
+    {"class_name": ..., "tool_desc": ..., "param_desc": ...}
+    if both properties return constant strings.
+    Returns None when the source can't be parsed or the values are computed at runtime,
+    in which case the caller has to import the module.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef) or not _is_tool_subclass(node):
+            continue
+        metadata = {"class_name": node.name}
+        for item in node.body:
+            name = _defined_name(item)
+            if name in METADATA_FIELDS:
+                metadata[name] = _property_value(item)
+        if all(metadata.get(field) is not None for field in METADATA_FIELDS):
+            return metadata
+        return None
+    return None
+
+
+def format_description(tool_desc, param_desc) -> str:
+    """Description of a tool as it is shown to the agents."""
+    return f"{tool_desc}. Params: {param_desc}"
+
+
+def format_tool_catalogue(tools) -> str:
+    """
+    Tool listing for prompts, sorted by name so the same set of tools always gives the same
+    text (and the prompt prefix can be reused by the model server). Non-dict values, like
+    "There are no tools yet", are passed through.
+    """
+    if not isinstance(tools, dict):
+        return str(tools)
+    return "\n".join(f"- {name}: {tools[name]}" for name in sorted(tools))
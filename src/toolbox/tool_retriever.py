@@ -0,0 +1,80 @@
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+
+class ToolRetriever:
+    """
+    In-memory vector index over tool descriptions.
+
+    Descriptions are embedded once and stored as rows of a normalized NumPy matrix,
+    so finding the k tools closest to a query is a single matrix-vector product.
+    The embedder is any callable mapping a list of texts to a list of vectors;
+    by default it uses an Ollama embedding model.
+    """
+
+    def __init__(self, embedder: Optional[Callable[[List[str]], Sequence[Sequence[float]]]] = None,
+                 embedding_model: str = "nomic-embed-text"):
+        if embedder is None:
+            from utils.ollama_utils import ollama_embed
+            embedder = lambda texts: ollama_embed(texts, model=embedding_model)
+        self.embedder = embedder
+        self._names: List[str] = []
+        self._descriptions: Dict[str, str] = {}
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self._names)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embedder(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, tools: Dict[str, str]):
+        """
+        Adds or updates tools given as {tool_name: description}.
+        Only tools whose description changed are re-embedded.
+        """
+        changed = {name: desc for name, desc in tools.items() if self._descriptions.get(name) != desc}
+        if not changed:
+            return
+        vectors = self._embed([f"{name}: {desc}" for name, desc in changed.items()])
+        positions = {name: i for i, name in enumerate(self._names)}
+        new_rows = []
+        for name, vector in zip(changed, vectors):
+            if name in positions:
+                self._matrix[positions[name]] = vector
+            else:
+                self._names.append(name)
+                new_rows.append(vector)
+            self._descriptions[name] = changed[name]
+        if new_rows:
+            new_rows = np.stack(new_rows)
+            self._matrix = new_rows if self._matrix is None else np.vstack([self._matrix, new_rows])
+
+    def remove(self, tool_name: str):
+        """Removes a tool from the index if present."""
+        if tool_name not in self._descriptions:
+            return
+        position = self._names.index(tool_name)
+        del self._names[position]
+        del self._descriptions[tool_name]
+        self._matrix = np.delete(self._matrix, position, axis=0)
+
+    def sync(self, tools: Dict[str, str]):
+        """Brings the index in line with the full toolbox listing {tool_name: description}."""
+        for tool_name in set(self._descriptions) - set(tools):
+            self.remove(tool_name)
+        self.upsert(tools)
+
+    def search(self, query: str, k: int) -> List[str]:
+        """Returns the names of the k tools most similar to the query, best match first."""
+        if not self._names:
+            return []
+        k = min(k, len(self._names))
+        query_vector = self._embed([query])[0]
+        scores = self._matrix @ query_vector
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._names[i] for i in top]
@@ -1,7 +1,12 @@
 import os
 import json
+import hashlib
+import functools
+import threading
 from typing import Optional, Dict, Type
 from .base_tool import Tool
+from .tool_metadata import extract_tool_metadata, format_description
+from utils.tracing import traced
 import sys
 
 
@@ -9,12 +14,104 @@ import sys
 TOOLS_DIR = "./generated_tools"
 os.makedirs(TOOLS_DIR, exist_ok=True)
 
+INDEX_VERSION = 1
+
+# Load statuses stored in the index
+STATUS_UNLOADED = "unloaded"  # description known, module never imported
+STATUS_OK = "ok"
+STATUS_BROKEN = "broken"      # import failed or no Tool class; not imported again until the file changes
+
+# Import errors that can go away without the tool changing, e.g. once a missing library is installed
+RETRIED_ERRORS = ("ImportError", "ModuleNotFoundError")
+
+# Entry fields that are written to the index file (tool_class and import_env only live in memory)
+PERSISTED_FIELDS = ("mtime", "size", "hash", "description", "tool_desc", "param_desc", "status", "error", "error_type")
+
+
+def _environment_signature() -> tuple:
+    """Changes when packages are installed or removed: the mtimes of the sys.path directories."""
+    signature = []
+    for path in sys.path:
+        try:
+            signature.append(os.stat(path or ".").st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _synchronized(method):
+    """Serializes calls to a ToolManager method, agents call them from worker threads."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class ToolManager:
-    def __init__(self, tools_dir: str = TOOLS_DIR):
+    def __init__(self, tools_dir: str = TOOLS_DIR, index_file: Optional[str] = None,
+                 retriever=None, top_k: int = 10):
         self.tools_dir = tools_dir
+        # Optional ToolRetriever: when set, agents only see the top_k tools relevant to their query
+        self.retriever = retriever
+        self.top_k = top_k
+        # The index lives next to the tools directory, e.g. ./generated_tools_index.json
+        self.index_file = index_file or f"{os.path.normpath(tools_dir)}_index.json"
         # Ensure tools directory is in sys.path to allow imports
         if self.tools_dir not in sys.path:
             sys.path.append(self.tools_dir)
+        # Registry of known tools: {tool_name: {"mtime", "size", "hash", "description", "tool_desc",
+        #                                       "param_desc", "status", "error", "tool_class"}}
+        self._registry: Dict[str, dict] = {}
+        self._lock = threading.RLock()
+        # The retriever has its own lock: its embedding calls go over the network and
+        # mustn't block the rest of the toolbox
+        self._retriever_lock = threading.Lock()
+        self._dir_mtime = None
+        self._index_dirty = False
+        self._load_index()
+
+    def _load_index(self):
+        """Restores the registry from the index file written by a previous process."""
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            if index.get("version") != INDEX_VERSION:
+                return
+            self._dir_mtime = index.get("dir_mtime")
+            for tool_name, stored in index.get("tools", {}).items():
+                entry = {field: stored.get(field) for field in PERSISTED_FIELDS}
+                entry["tool_class"] = None
+                entry["import_env"] = None
+                self._registry[tool_name] = entry
+        except Exception as e:
+            print(f"Error reading toolbox index {self.index_file}: {e}")
+            self._registry.clear()
+            self._dir_mtime = None
+
+    @_synchronized
+    def save_index(self):
+        """Writes the registry to the index file if it changed since the last save."""
+        if not self._index_dirty:
+            return
+        index = {
+            "version": INDEX_VERSION,
+            "dir_mtime": self._dir_mtime,
+            "tools": {
+                tool_name: {field: entry[field] for field in PERSISTED_FIELDS}
+                for tool_name, entry in sorted(self._registry.items())
+            },
+        }
+        tmp_file = f"{self.index_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(index, f, indent=1)
+            os.replace(tmp_file, self.index_file)
+            self._index_dirty = False
+        except Exception as e:
+            print(f"Error writing toolbox index {self.index_file}: {e}")
 
     def _tool_filename(self, tool_name: str) -> str:
         """Get the .py file name for a given tool name."""
@@ -27,18 +124,30 @@ class ToolManager:
         Returns True if successful, False otherwise.
         """
         output_file = self._tool_filename(tool_name)
-        if os.path.exists(output_file):
-            print(f"Tool '{tool_name}' already exists at {output_file}.")
-            return False
-        try:
-            with open(output_file, 'w') as file:
-                file.write(tool_code)
-            print(f"Tool '{tool_name}' has been created at {output_file}.")
-            return True
-        except Exception as e:
-            print(f"Error saving tool '{tool_name}': {e}")
-            return False
+        with self._lock:
+            if os.path.exists(output_file):
+                print(f"Tool '{tool_name}' already exists at {output_file}.")
+                return False
+            try:
+                with open(output_file, 'w') as file:
+                    file.write(tool_code)
+                self.invalidate(tool_name)
+                print(f"Tool '{tool_name}' has been created at {output_file}.")
+            except Exception as e:
+                print(f"Error saving tool '{tool_name}': {e}")
+                return False
+        if self.retriever is not None:
+            # The tool is saved either way; a failed embedding is caught up by the next retriever.sync()
+            try:
+                description = self.describe_tool(tool_name)
+                if description is not None:
+                    with self._retriever_lock:
+                        self.retriever.upsert({tool_name: description})
+            except Exception as e:
+                print(f"Error indexing tool '{tool_name}' for retrieval: {e}")
+        return True
 
+    @_synchronized
     def delete_tool(self, tool_name: str) -> bool:
         """
         Deletes the .py file for the specified tool.
@@ -47,24 +156,122 @@ class ToolManager:
         py_path = self._tool_filename(tool_name)
         if os.path.exists(py_path):
             os.remove(py_path)
+            self.invalidate(tool_name)
+            if self.retriever is not None:
+                with self._retriever_lock:
+                    self.retriever.remove(tool_name)
             print(f'{tool_name} deleted')
             return True
         return False
 
-    def get_tool(self, tool_name: str) -> Optional[Tool]:
+    def rename_tool(self, tool_name: str, new_name: str) -> bool:
         """
-        Imports the tool_name.py module, finds a class inheriting from Tool, 
-        instantiates it, and returns it.
-        Returns None if not found.
+        Renames the .py file of a tool.
+        Returns True if successful, False if the tool doesn't exist or new_name is taken.
         """
-        import importlib.util
-        import sys
+        py_path = self._tool_filename(tool_name)
+        new_path = self._tool_filename(new_name)
+        with self._lock:
+            if not os.path.exists(py_path) or os.path.exists(new_path):
+                return False
+            os.replace(py_path, new_path)
+            self.invalidate(tool_name)
+            self.invalidate(new_name)
+            print(f"Tool '{tool_name}' renamed to '{new_name}'.")
+        if self.retriever is not None:
+            try:
+                description = self.describe_tool(new_name)
+                with self._retriever_lock:
+                    self.retriever.remove(tool_name)
+                    if description is not None:
+                        self.retriever.upsert({new_name: description})
+            except Exception as e:
+                print(f"Error indexing tool '{new_name}' for retrieval: {e}")
+        return True
 
+    @_synchronized
+    def invalidate(self, tool_name: Optional[str] = None):
+        """
+        Drops the cached registry entry for tool_name, or the whole registry if no name is given.
+        """
+        if tool_name is None:
+            self._registry.clear()
+            self._dir_mtime = None
+        else:
+            self._registry.pop(tool_name, None)
+        self._index_dirty = True
+
+    def _file_signature(self, py_path: str):
+        """Cheap change detector for a tool file: (mtime in ns, size in bytes)."""
+        stat = os.stat(py_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_entry(self, tool_name: str) -> Optional[dict]:
+        """
+        Returns the registry entry for tool_name, refreshing it only if the file
+        is new or its content has changed since it was last read.
+        The description is read statically from the source; the module itself is
+        imported lazily by _import_tool. Returns None if the tool file is missing.
+        """
         py_path = self._tool_filename(tool_name)
         if not os.path.exists(py_path):
+            if self._registry.pop(tool_name, None) is not None:
+                self._index_dirty = True
             print(f"Tool file for {tool_name} not found at {py_path}.")
             return None
 
+        mtime, size = self._file_signature(py_path)
+        entry = self._registry.get(tool_name)
+        if entry is not None and entry["mtime"] == mtime and entry["size"] == size:
+            return entry
+
+        # The file was touched: only refresh if its content really differs
+        with open(py_path, 'rb') as f:
+            source = f.read()
+        code_hash = hashlib.sha256(source).hexdigest()
+        self._index_dirty = True
+        if entry is not None and entry["hash"] == code_hash:
+            entry["mtime"], entry["size"] = mtime, size
+            return entry
+
+        entry = {
+            "mtime": mtime, "size": size, "hash": code_hash,
+            "description": None, "tool_desc": None, "param_desc": None,
+            "status": STATUS_UNLOADED, "error": None, "error_type": None, "tool_class": None, "import_env": None,
+        }
+        metadata = extract_tool_metadata(source.decode('utf-8', errors='replace'))
+        if metadata is not None:
+            entry["tool_desc"], entry["param_desc"] = metadata["tool_desc"], metadata["param_desc"]
+            entry["description"] = format_description(metadata["tool_desc"], metadata["param_desc"])
+        self._registry[tool_name] = entry
+        return entry
+
+    def _should_retry(self, entry: dict) -> bool:
+        """
+        True for a tool that failed with an ImportError the environment may have fixed since:
+        once per process (import_env isn't persisted) and whenever packages were installed.
+        """
+        return entry["error_type"] in RETRIED_ERRORS and entry["import_env"] != _environment_signature()
+
+    def _import_tool(self, tool_name: str, entry: dict) -> Optional[Type[Tool]]:
+        """
+        Imports tool_name.py once per content hash and caches its Tool class in the entry.
+        Broken tools are recorded in the index so they aren't re-imported, even by a new
+        process, until their file changes. Tools that failed on a missing module are the
+        exception, see _should_retry.
+        """
+        import importlib
+        import importlib.util
+
+        if entry["tool_class"] is not None:
+            return entry["tool_class"]
+        if entry["status"] == STATUS_BROKEN:
+            if not self._should_retry(entry):
+                return None
+            # The finders cache directory listings, newly installed packages wouldn't be found
+            importlib.invalidate_caches()
+        self._index_dirty = True
+
         # Remove cached module if already imported
         module_name = f"{tool_name}"
         if module_name in sys.modules:
@@ -72,6 +279,7 @@ class ToolManager:
 
         try:
             # Dynamically import the tool module
+            py_path = self._tool_filename(tool_name)
             spec = importlib.util.spec_from_file_location(module_name, py_path)
             module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(module)  # type: ignore
@@ -80,34 +288,126 @@ class ToolManager:
             tool_class = self._find_tool_class(module)
             if tool_class is None:
                 print(f"No valid Tool class found in {tool_name}.py.")
+                entry["status"], entry["error"], entry["error_type"] = STATUS_BROKEN, "No valid Tool class found.", None
                 return None
 
-            # Instantiate and return
-            return tool_class()
+            if entry["description"] is None:
+                tool_obj = tool_class()
+                entry["tool_desc"], entry["param_desc"] = tool_obj.tool_desc, tool_obj.param_desc
+                entry["description"] = format_description(tool_obj.tool_desc, tool_obj.param_desc)
+            entry["tool_class"] = tool_class
+            entry["status"], entry["error"], entry["error_type"] = STATUS_OK, None, None
+            return tool_class
         except Exception as e:
             print(f"Error loading tool {tool_name}: {e}")
+            entry["status"], entry["error"], entry["error_type"] = STATUS_BROKEN, str(e), type(e).__name__
+            entry["import_env"] = _environment_signature()
             return None
 
+    @_synchronized
+    def get_tool(self, tool_name: str) -> Optional[Tool]:
+        """
+        Finds the class inheriting from Tool in tool_name.py, instantiates it, and returns it.
+        The class is taken from the registry unless the file changed since it was loaded.
+        Returns None if not found.
+        """
+        entry = self._load_entry(tool_name)
+        if entry is None:
+            return None
+        tool_class = self._import_tool(tool_name, entry)
+        self.save_index()
+        if tool_class is None:
+            return None
+        return tool_class()
+
+    @_synchronized
+    def tool_error(self, tool_name: str) -> Optional[str]:
+        """The error that made the tool broken, None if it loads (or doesn't exist)."""
+        entry = self._load_entry(tool_name)
+        if entry is None:
+            return None
+        if entry["status"] == STATUS_BROKEN and self._should_retry(entry):
+            self._import_tool(tool_name, entry)
+        return entry["error"] if entry["status"] == STATUS_BROKEN else None
+
+    @_synchronized
+    def describe_tool(self, tool_name: str) -> Optional[str]:
+        """
+        Returns the description of a tool, importing its module only if
+        tool_desc/param_desc can't be read statically.
+        Broken tools are described with their error, so agents can see why they fail.
+        """
+        entry = self._load_entry(tool_name)
+        if entry is None:
+            return None
+        if entry["description"] is None or (entry["status"] == STATUS_BROKEN and self._should_retry(entry)):
+            self._import_tool(tool_name, entry)
+        if entry["status"] == STATUS_BROKEN:
+            return f"{entry['description'] or 'No description'} [broken: {entry['error']}]"
+        return entry["description"]
+
+    def _tool_names(self):
+        """
+        Names of the tools in the tools directory.
+        The directory is only listed again when its mtime changes (a file was added,
+        removed or renamed); otherwise the names known to the index are reused.
+        """
+        dir_mtime = os.stat(self.tools_dir).st_mtime_ns
+        if dir_mtime == self._dir_mtime:
+            return list(self._registry)
+        tool_names = [filename[:-3] for filename in os.listdir(self.tools_dir) if filename.endswith(".py")]
+        # Forget tools whose files were removed outside of delete_tool
+        for tool_name in set(self._registry) - set(tool_names):
+            del self._registry[tool_name]
+        self._dir_mtime = dir_mtime
+        self._index_dirty = True
+        return tool_names
+
+    @traced("ToolManager.list_tools")
+    @_synchronized
     def list_tools(self) -> Dict[str, str]:
         """
-        Lists all tool .py files in the tools directory, imports them, 
-        and retrieves their name and description.
+        Lists all tool .py files in the tools directory and retrieves their name and description.
+        Descriptions are parsed from the source and kept in the persistent index, so listing
+        doesn't run tool code unless a tool computes its description dynamically.
+        Broken tools are listed with their error.
         Returns a dict {tool_name: description}.
         """
         tools = {}
-        for filename in os.listdir(self.tools_dir):
-            if filename.endswith(".py"):
-                tool_name = filename[:-3]  # Remove the .py extension
-                try:
-                    tool_obj = self.get_tool(tool_name)
-                    if tool_obj is not None:
-                        tools[tool_name] = f"{tool_obj.tool_desc}. Params: {tool_obj.param_desc}"
-                except Exception as e:
-                    print(f"Error loading tool {tool_name}: {e}")
+        for tool_name in self._tool_names():
+            try:
+                description = self.describe_tool(tool_name)
+                if description is not None:
+                    tools[tool_name] = description
+            except Exception as e:
+                print(f"Error loading tool {tool_name}: {e}")
+        self.save_index()
         if len(tools.keys()) == 0:
             return "There are no tools yet"
         return tools
 
+    @traced("ToolManager.relevant_tools")
+    def relevant_tools(self, query: str, k: Optional[int] = None) -> Dict[str, str]:
+        """
+        Returns the k tools most relevant to the query as {tool_name: description}.
+        Falls back to the full list_tools() output when no retriever is configured
+        or the toolbox isn't larger than k.
+        Only the listing holds the toolbox lock, the embedding calls of the retriever don't.
+        """
+        tools = self.list_tools()
+        k = k or self.top_k
+        if self.retriever is None or not isinstance(tools, dict) or len(tools) <= k:
+            return tools
+        try:
+            with self._retriever_lock:
+                self.retriever.sync(tools)
+                names = self.retriever.search(query, k)
+            # A tool deleted meanwhile is no longer in the snapshot
+            return {tool_name: tools[tool_name] for tool_name in names if tool_name in tools}
+        except Exception as e:
+            print(f"Tool retrieval failed, using the full toolbox: {e}")
+            return tools
+
     def _find_tool_class(self, module) -> Optional[Type[Tool]]:
         """
         Find a class in the given module that inherits from Tool.
@@ -0,0 +1,138 @@
+import hashlib
+import mmap
+import os
+import pickle
+import shutil
+import threading
+from typing import Optional
+from utils.prompt_budget import excerpt
+
+HANDLE_PREFIX = "artifact:sha256:"
+
+# Blob kinds, stored as the file extension
+KIND_TEXT = "txt"
+KIND_BYTES = "bin"
+KIND_PICKLE = "pkl"
+
+
+def is_handle(value) -> bool:
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for large tool outputs.
+
+    offload() writes outputs bigger than threshold bytes once to
+    root/<2 hex>/<sha256>.<kind> and returns a compact reference instead:
+    {"artifact": "artifact:sha256:...", "preview": head/tail excerpt, "size": bytes}.
+    References are what ends up in the artifacts and prompts; resolve() turns them
+    back into the full content when a tool gets them as arguments. Blobs are read
+    with mmap, so reading a preview or a slice doesn't load the whole file.
+    """
+
+    def __init__(self, root: str = "artifacts", threshold: int = 2000, preview_chars: int = 300):
+        self.root = root
+        self.threshold = threshold
+        self.preview_chars = preview_chars
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, digest: str, kind: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.{kind}")
+
+    def _find(self, handle: str) -> Optional[str]:
+        digest = handle[len(HANDLE_PREFIX):]
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        for kind in (KIND_TEXT, KIND_BYTES, KIND_PICKLE):
+            path = self._path(digest, kind)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _serialize(value):
+        if isinstance(value, str):
+            return value.encode('utf-8'), KIND_TEXT
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value), KIND_BYTES
+        return pickle.dumps(value), KIND_PICKLE
+
+    def put(self, value) -> str:
+        """Stores value (text, bytes or any picklable object) and returns its handle."""
+        data, kind = self._serialize(value)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest, kind)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        return HANDLE_PREFIX + digest
+
+    def read(self, handle: str, start: int = 0, end: Optional[int] = None) -> Optional[bytes]:
+        """Raw bytes [start:end] of a blob, or None if the handle is unknown."""
+        path = self._find(handle)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                return blob[start:end]
+
+    def get(self, handle: str):
+        """The stored value of a handle, or None if it's unknown."""
+        path = self._find(handle)
+        if path is None:
+            return None
+        data = self.read(handle)
+        if path.endswith(KIND_TEXT):
+            return data.decode('utf-8')
+        if path.endswith(KIND_PICKLE):
+            return pickle.loads(data)
+        return data
+
+    def offload(self, value):
+        """Returns small values unchanged and a reference with a preview for large ones."""
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        try:
+            data, _ = self._serialize(value)
+        except Exception:
+            # Not picklable: only its text form can be kept
+            value = str(value)
+            data, _ = self._serialize(value)
+        if len(data) <= self.threshold:
+            return value
+        text = value if isinstance(value, str) else repr(value)
+        return {
+            "artifact": self.put(value),
+            "preview": excerpt(text, self.preview_chars),
+            "size": len(data),
+        }
+
+    def resolve(self, value):
+        """
+        Replaces handles and references inside value (e.g. tool_args) with the stored content.
+        Unknown handles are left as they are.
+        """
+        if is_handle(value):
+            content = self.get(value)
+            return value if content is None else content
+        if isinstance(value, dict):
+            if is_handle(value.get("artifact")) and set(value) <= {"artifact", "preview", "size"}:
+                return self.resolve(value["artifact"])
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        return value
+
+    def clear(self):
+        """Deletes all blobs."""
+        with self._lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            os.makedirs(self.root, exist_ok=True)
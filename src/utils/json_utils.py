@@ -0,0 +1,258 @@
+import ast
+import json
+import re
+from typing import Any, Optional, Tuple
+
+OPENING = {'{': '}', '[': ']'}
+
+# Opening quote -> closing quote of the string delimiters models produce
+QUOTES = {'"': '"', "'": "'", '\u201c': '\u201d', '\u2018': '\u2019'}
+
+PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+# What may precede a JSON value on its line: nothing but indentation, or a code fence opener
+LINE_START = re.compile(r"\s*(```[\w-]*\s*)?")
+
+# Contents of a ```json code fence, up to its closing fence or the end of a truncated answer
+JSON_FENCE = re.compile(r"```json\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+
+
+class JsonStreamDetector:
+    """
+    Incremental scanner that detects when the first top-level JSON object or array
+    of a text stream is complete.
+
+    A value only starts at a '{' or '[' that opens a line or follows a code fence, so
+    brackets in leading prose ("Here is the plan [in JSON]:") aren't taken for the answer;
+    with anywhere=True any bracket can start one. A balanced value that doesn't parse
+    (even after repairs) is dropped and scanning goes on after its first bracket.
+    Brackets inside strings are ignored; both double- and single-quoted strings are
+    recognised, since models sometimes answer with Python-style pseudo-JSON.
+    """
+
+    def __init__(self, anywhere: bool = False):
+        self.anywhere = anywhere
+        self.text = ""
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        # The parsed value and the repairs it needed, once complete
+        self.value = None
+        self.repairs = 0
+        self._position = 0
+        self._stack = []
+        self._quote = None
+        self._escape = False
+
+    @property
+    def started(self) -> bool:
+        return self.start is not None
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    @property
+    def value_text(self) -> Optional[str]:
+        """Text of the first complete JSON value, or None if it isn't complete yet."""
+        if self.end is None:
+            return None
+        return self.text[self.start:self.end]
+
+    def _can_start(self, index: int) -> bool:
+        if self.anywhere:
+            return True
+        line_start = self.text.rfind("\n", 0, index) + 1
+        return LINE_START.fullmatch(self.text, line_start, index) is not None
+
+    def feed(self, chunk: str) -> bool:
+        """Consumes the next chunk of text and returns True once the first valid value is complete."""
+        self.text += chunk
+        if self.end is not None:
+            return True
+        index = self._position
+        while index < len(self.text):
+            char = self.text[index]
+            index += 1
+            if self.start is None:
+                if char in OPENING and self._can_start(index - 1):
+                    self.start = index - 1
+                    self._stack.append(OPENING[char])
+                continue
+            if self._quote is not None:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                continue
+            if char in ('"', "'"):
+                self._quote = char
+            elif char in OPENING:
+                self._stack.append(OPENING[char])
+            elif self._stack and char == self._stack[-1]:
+                self._stack.pop()
+                if not self._stack:
+                    try:
+                        self.value, self.repairs = _parse_candidate(self.text[self.start:index])
+                    except JsonRepairError:
+                        # Brackets of prose, not a value: look for the next one
+                        index = self.start + 1
+                        self.start = None
+                        continue
+                    self.end = index
+                    self._position = index
+                    return True
+        self._position = index
+        return False
+
+
+class JsonRepairError(ValueError):
+    """Raised by extract_json when no JSON value can be recovered from the text."""
+
+
+def _read_string(text: str, start: int) -> Tuple[str, int]:
+    """
+    Reads the string whose opening quote is at text[start].
+    Returns its content (escapes kept as written) and the index after the closing quote.
+    """
+    closing = QUOTES[text[start]]
+    index = start + 1
+    content = []
+    while index < len(text):
+        char = text[index]
+        if char == '\\' and index + 1 < len(text):
+            content.append(text[index:index + 2])
+            index += 2
+            continue
+        if char == closing:
+            return "".join(content), index + 1
+        content.append(char)
+        index += 1
+    # Unterminated string: take everything that is left
+    return "".join(content), index
+
+
+def _repair(text: str) -> Tuple[str, int]:
+    """
+    Applies cheap syntactic repairs outside of strings:
+    single/typographic quotes -> double quotes, trailing commas dropped,
+    Python True/False/None -> true/false/null.
+    Returns the repaired text and the number of repairs made.
+    """
+    out = []
+    repairs = 0
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char in QUOTES:
+            content, index = _read_string(text, index)
+            if char != '"':
+                repairs += 1
+                content = content.replace("\\'", "'").replace('"', '\\"')
+            out.append(f'"{content}"')
+            continue
+        if char == ',':
+            following = text[index + 1:].lstrip()
+            if not following or following[0] in '}]':
+                repairs += 1
+                index += 1
+                continue
+        if char.isalpha() or char == '_':
+            end = index
+            while end < len(text) and (text[end].isalnum() or text[end] == '_'):
+                end += 1
+            word = text[index:end]
+            if word in PYTHON_LITERALS:
+                repairs += 1
+                word = PYTHON_LITERALS[word]
+            out.append(word)
+            index = end
+            continue
+        out.append(char)
+        index += 1
+    return "".join(out), repairs
+
+
+def _parse_candidate(candidate: str) -> Tuple[Any, int]:
+    """
+    Parses a balanced JSON candidate, with cheap repairs if it isn't valid JSON.
+    Returns (value, repairs) or raises JsonRepairError.
+    """
+    try:
+        return json.loads(candidate, strict=False), 0
+    except json.JSONDecodeError:
+        pass
+
+    repaired, fixes = _repair(candidate)
+    try:
+        return json.loads(repaired, strict=False), fixes
+    except json.JSONDecodeError:
+        pass
+
+    # Last resort: the model may have answered with a Python literal
+    try:
+        value = ast.literal_eval(candidate)
+        if isinstance(value, (dict, list)):
+            return value, 1
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        pass
+    raise JsonRepairError(f"Unable to repair JSON: {candidate[:200]}")
+
+
+def extract_json(text: str) -> Tuple[Any, int]:
+    """
+    Extracts the first JSON object or array from an LLM answer.
+
+    The contents of a ```json code fence are preferred when there is one. Otherwise
+    the first balanced value that parses is taken; brackets in prose that don't parse
+    are skipped. Cheap repairs are tried before a candidate is given up: closing brackets
+    of a truncated value, quote normalisation, trailing commas and Python literals.
+
+    Returns (value, repairs) where repairs is the number of fixes that were needed
+    (0 for valid JSON). Raises JsonRepairError if nothing can be recovered.
+
+    >>> extract_json('Sure: {"a": 1} and more')
+    ({'a': 1}, 0)
+    >>> extract_json("Here's the plan [don't panic]: [1, 2]")
+    ([1, 2], 0)
+    >>> extract_json("It's [truncated: [1, 2")
+    ([1, 2], 1)
+    """
+    fence = JSON_FENCE.search(text)
+    if fence is not None:
+        try:
+            return _extract_value(fence.group(1))
+        except JsonRepairError:
+            pass
+    return _extract_value(text)
+
+
+def _extract_value(text: str) -> Tuple[Any, int]:
+    """
+    The first value of text that parses, closing it if the text is truncated.
+    An unclosed candidate that doesn't parse once closed, e.g. a bracket in prose with an
+    apostrophe that opens a string, is skipped like a balanced one: scanning goes on after its bracket.
+    """
+    offset = 0
+    error = None
+    while True:
+        detector = JsonStreamDetector(anywhere=True)
+        detector.feed(text[offset:])
+        if detector.complete:
+            return detector.value, detector.repairs
+        if not detector.started:
+            raise error or JsonRepairError("No JSON object or array found in the response.")
+
+        # Truncated answer: close whatever is still open
+        candidate = detector.text[detector.start:]
+        if detector._quote is not None:
+            candidate += detector._quote
+        candidate += "".join(reversed(detector._stack))
+        try:
+            value, repairs = _parse_candidate(candidate)
+        except JsonRepairError as e:
+            error = e
+            offset += detector.start + 1
+            continue
+        return value, repairs + 1
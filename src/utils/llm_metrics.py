@@ -0,0 +1,202 @@
+import contextlib
+import contextvars
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tags of the LLM calls made in the current context: {"agent", "method", "attempt", "subtask", ...}
+_call_tags = contextvars.ContextVar("llm_call_tags", default={})
+
+# Timing fields reported by Ollama in nanoseconds
+DURATION_FIELDS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+COUNT_FIELDS = ("prompt_eval_count", "eval_count")
+
+_records = deque(maxlen=10000)
+_jsonl_path = None
+_lock = threading.Lock()
+_server = None
+
+
+def configure_metrics(jsonl_path: str = None, max_records: int = 10000):
+    """
+    Sets the JSONL file every LLM call record is appended to (None to keep them in memory only)
+    and how many recent records are kept for the aggregates.
+    """
+    global _records, _jsonl_path
+    with _lock:
+        _jsonl_path = jsonl_path
+        _records = deque(_records, maxlen=max_records)
+
+
+@contextlib.contextmanager
+def llm_call_tags(**tags):
+    """
+    Tags the LLM calls made inside the block, e.g.
+    with llm_call_tags(agent="Critic", method="evaluate", attempt=0): ...
+    Nested blocks add to the outer tags. The tags follow asyncio tasks and
+    asyncio.to_thread calls started inside the block.
+    """
+    token = _call_tags.set({**_call_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _call_tags.reset(token)
+
+
+def record_llm_call(model: str, duration: float, response=None, cached: bool = False, replayed: bool = False,
+                    stopped_early: bool = False, chunks: int = 0, error: str = None):
+    """
+    Records one LLM call with the current tags.
+    response is the final Ollama response (or stream chunk) carrying its counters. A stream that was
+    stopped early has none, then the number of received chunks is used as eval_count.
+    replayed marks calls answered from a recorded session (utils.llm_session).
+    """
+    record = {"time": time.time(), "model": model, **_call_tags.get(), "duration": duration,
+              "cached": cached, "replayed": replayed, "stopped_early": stopped_early, "error": error}
+    for field in COUNT_FIELDS:
+        record[field] = response.get(field) if response is not None else None
+    for field in DURATION_FIELDS:
+        value = response.get(field) if response is not None else None
+        record[field] = value / 1e9 if value else None
+    if record["eval_count"] is None and chunks:
+        record["eval_count"] = chunks
+    with _lock:
+        _records.append(record)
+        if _jsonl_path is not None:
+            with open(_jsonl_path, 'a') as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+
+def _percentile(values: list, q: float):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[max(math.ceil(q * len(values)) - 1, 0)]
+
+
+def metrics_summary() -> dict:
+    """
+    Aggregates of the recorded calls:
+    {"calls": {"Agent.method": {...latency percentiles, tokens, tokens/s...}},
+     "routes": {"Agent.method": {model: {"calls", "errors", latency percentiles}}},
+     "subtasks": {subtask: {"calls", "retries"}}}
+    "routes" splits every label by the model that served it, see utils.model_router.
+    """
+    with _lock:
+        records = list(_records)
+    calls = {}
+    routes = {}
+    subtasks = {}
+    for record in records:
+        label = f"{record.get('agent', 'unknown')}.{record.get('method', 'unknown')}"
+        group = calls.setdefault(label, {"calls": 0, "cached": 0, "replayed": 0, "errors": 0, "latencies": [],
+                                         "prompt_tokens": 0, "eval_tokens": 0, "eval_seconds": 0.0,
+                                         "load_seconds": 0.0})
+        group["calls"] += 1
+        if record["cached"]:
+            group["cached"] += 1
+        if record.get("replayed"):
+            group["replayed"] += 1
+        if record["error"]:
+            group["errors"] += 1
+        if not record["cached"]:
+            group["latencies"].append(record["duration"])
+        group["prompt_tokens"] += record["prompt_eval_count"] or 0
+        group["eval_tokens"] += record["eval_count"] or 0
+        group["load_seconds"] += record["load_duration"] or 0.0
+        # Early-stopped streams have no eval_duration, their generation time is the wall-clock time
+        group["eval_seconds"] += record["eval_duration"] or (record["duration"] if record["eval_count"] else 0.0)
+
+        route = routes.setdefault(label, {}).setdefault(record["model"], {"calls": 0, "errors": 0, "latencies": []})
+        route["calls"] += 1
+        if record["error"]:
+            route["errors"] += 1
+        if not record["cached"]:
+            route["latencies"].append(record["duration"])
+
+        if record.get("subtask") is not None:
+            stats = subtasks.setdefault(record["subtask"], {"calls": 0, "retries": 0})
+            stats["calls"] += 1
+            if record.get("attempt"):
+                stats["retries"] += 1
+
+    for group in calls.values():
+        latencies = group.pop("latencies")
+        group["p50_latency"] = _percentile(latencies, 0.5) if latencies else None
+        group["p95_latency"] = _percentile(latencies, 0.95) if latencies else None
+        group["total_latency"] = sum(latencies)
+        group["tokens_per_second"] = group["eval_tokens"] / group["eval_seconds"] if group["eval_seconds"] else None
+    for models in routes.values():
+        for route in models.values():
+            latencies = route.pop("latencies")
+            route["p50_latency"] = _percentile(latencies, 0.5) if latencies else None
+            route["p95_latency"] = _percentile(latencies, 0.95) if latencies else None
+            route["total_latency"] = sum(latencies)
+    return {"calls": calls, "routes": routes, "subtasks": subtasks}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    """The aggregates in the Prometheus text exposition format."""
+    summary = metrics_summary()
+    groups = []
+    for label, group in sorted(summary["calls"].items()):
+        agent, _, method = label.partition(".")
+        groups.append((f'agent="{_escape(agent)}",method="{_escape(method)}"', group))
+
+    # (family, type, [(labels, value)]): every family is written as one block
+    families = [
+        ("llm_calls_total", "counter", [(tags, group["calls"]) for tags, group in groups]),
+        ("llm_cached_calls_total", "counter", [(tags, group["cached"]) for tags, group in groups]),
+        ("llm_errors_total", "counter", [(tags, group["errors"]) for tags, group in groups]),
+        ("llm_prompt_tokens_total", "counter", [(tags, group["prompt_tokens"]) for tags, group in groups]),
+        ("llm_eval_tokens_total", "counter", [(tags, group["eval_tokens"]) for tags, group in groups]),
+        ("llm_load_seconds_total", "counter", [(tags, group["load_seconds"]) for tags, group in groups]),
+        ("llm_tokens_per_second", "gauge",
+         [(tags, group["tokens_per_second"]) for tags, group in groups if group["tokens_per_second"] is not None]),
+        ("llm_subtask_retries_total", "counter",
+         [(f'subtask="{_escape(subtask)}"', stats["retries"]) for subtask, stats in sorted(summary["subtasks"].items())]),
+    ]
+    lines = []
+    for family, kind, samples in families:
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(f"{family}{{{tags}}} {value}" for tags, value in samples)
+
+    lines.append("# TYPE llm_latency_seconds summary")
+    for tags, group in groups:
+        if group["p50_latency"] is not None:
+            lines.append(f'llm_latency_seconds{{{tags},quantile="0.5"}} {group["p50_latency"]:.6f}')
+            lines.append(f'llm_latency_seconds{{{tags},quantile="0.95"}} {group["p95_latency"]:.6f}')
+        lines.append(f"llm_latency_seconds_sum{{{tags}}} {group['total_latency']:.6f}")
+        lines.append(f"llm_latency_seconds_count{{{tags}}} {group['calls'] - group['cached']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = 9464, host: str = "127.0.0.1"):
+    """Serves prometheus_text() at http://host:port/metrics from a daemon thread."""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="llm-metrics-server", daemon=True).start()
+    return _server
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+from collections import deque
+from typing import Callable, Optional, Union
+
+# What a replay does when a request isn't in the session
+FALLBACK_LIVE = "live"    # Call Ollama
+FALLBACK_ERROR = "error"  # Raise ReplayMissError
+
+
+class ReplayMissError(KeyError):
+    """Raised in replay mode for a request that isn't in the session and fallback is "error"."""
+
+
+def embed_key(model: str, texts) -> str:
+    """Content address of an embedding request, the counterpart of llm_cache.request_key."""
+    payload = json.dumps({"model": model, "input": list(texts)}, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SessionRecorder:
+    """
+    Appends every live LLM request/response pair to a JSONL session file:
+    {"kind": "chat" | "embed", "key": ..., "model": ..., "request": {...}, "response": ..., "duration": seconds}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.recorded = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def record(self, kind: str, key: str, model: str, request: dict, response, duration: float):
+        line = json.dumps({"kind": kind, "key": key, "model": model, "request": request,
+                           "response": response, "duration": duration}, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+
+class SessionReplay:
+    """
+    Serves the responses of a recorded session back, keyed by request hash.
+
+    A request that was made several times (e.g. retries with use_cache=False) gets the
+    recorded responses in their original order; after the last one it keeps getting the last.
+    Requests that aren't in the session go to fallback: "live", "error" or a callable
+    request -> response (e.g. benchmarks.mock_ollama.ScriptedResponder).
+    With simulate_latency=True a replayed response waits as long as the recorded call took.
+    """
+
+    def __init__(self, path: str, fallback: Union[str, Callable[[dict], str]] = FALLBACK_LIVE,
+                 simulate_latency: bool = False):
+        self.path = path
+        self.fallback = fallback
+        self.simulate_latency = simulate_latency
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                self._entries.setdefault(entry["key"], deque()).append((entry["response"], entry.get("duration") or 0.0))
+
+    def lookup(self, key: str) -> Optional[tuple]:
+        """(response, recorded duration) for key, or None if the session doesn't have it."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0,
+                    "keys": len(self._entries)}
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from utils.llm_metrics import llm_call_tags
+from utils.ollama_utils import async_load_model, get_async_client, run_sync
+
+logger = logging.getLogger(__name__)
+
+
+def _full_name(model: str) -> str:
+    """Ollama names models without a tag as name:latest."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelResidency:
+    """
+    Keeps the models the agents use loaded in Ollama, so no LLM call of the loop pays
+    for loading a model (load_duration) on its critical path.
+
+    At startup health_check() makes sure the server answers and has every model, and
+    warm_up() loads them all concurrently. keep_alive pins them: -1 keeps them loaded
+    until the server stops, None uses the one set with utils.ollama_utils.configure_client.
+    Every request sets keep_alive again, so configure_client should get the same value,
+    otherwise the first LLM call replaces the pin with its own.
+    Models can still be evicted, e.g. when another one needs the memory, so schedule_rewarm()
+    checks which ones are loaded (/api/ps) between iterations and reloads the missing ones
+    in the background.
+    """
+
+    def __init__(self, models, embedding_models=(), keep_alive=-1):
+        self.embedding_models = list(dict.fromkeys(embedding_models))
+        self.models = [model for model in dict.fromkeys(models) if model not in self.embedding_models]
+        self.keep_alive = keep_alive
+        self.rewarms = 0
+        self._rewarm_task = None
+
+    def all_models(self) -> list:
+        return self.models + self.embedding_models
+
+    async def async_health_check(self) -> dict:
+        """
+        Returns {"ok": bool, "missing": [...], "error": ... or None}: ok if the server
+        answers and has all configured models.
+        """
+        try:
+            response = await get_async_client().list()
+        except Exception as e:
+            logger.error(f"Ollama server is not reachable: {e}")
+            return {"ok": False, "missing": self.all_models(), "error": f"{type(e).__name__}: {e}"}
+        available = {_full_name(model.model) for model in response.models if model.model}
+        missing = [model for model in self.all_models() if _full_name(model) not in available]
+        if missing:
+            logger.error(f"Models missing on the Ollama server, pull them first: {missing}")
+        return {"ok": not missing, "missing": missing, "error": None}
+
+    def health_check(self) -> dict:
+        """Synchronous version of async_health_check."""
+        return run_sync(self.async_health_check())
+
+    async def _load(self, model: str) -> dict:
+        started_at = time.perf_counter()
+        try:
+            with llm_call_tags(agent="ModelResidency", method="warm_up"):
+                response = await async_load_model(model, embedding=model in self.embedding_models,
+                                                  keep_alive=self.keep_alive)
+        except Exception as e:
+            logger.warning(f"Loading model {model} failed: {e}")
+            return {"loaded": False, "seconds": time.perf_counter() - started_at, "error": f"{type(e).__name__}: {e}"}
+        load_duration = response.get("load_duration")
+        return {"loaded": True, "seconds": time.perf_counter() - started_at,
+                "load_seconds": load_duration / 1e9 if load_duration else 0.0, "error": None}
+
+    async def async_warm_up(self, models=None) -> dict:
+        """Loads the models (all configured ones by default) concurrently. Returns {model: result}."""
+        models = list(models) if models is not None else self.all_models()
+        results = await asyncio.gather(*(self._load(model) for model in models))
+        report = dict(zip(models, results))
+        logger.info(f"Warmed up models: {report}")
+        return report
+
+    def warm_up(self, models=None) -> dict:
+        """Synchronous version of async_warm_up."""
+        return run_sync(self.async_warm_up(models))
+
+    async def async_loaded_models(self) -> set:
+        """The configured models Ollama currently has in memory."""
+        response = await get_async_client().ps()
+        loaded = {_full_name(model.model or model.name) for model in response.models}
+        return {model for model in self.all_models() if _full_name(model) in loaded}
+
+    async def async_rewarm(self) -> list:
+        """Reloads the configured models that were evicted. Returns their names."""
+        try:
+            loaded = await self.async_loaded_models()
+        except Exception as e:
+            logger.warning(f"Checking the loaded models failed: {e}")
+            return []
+        evicted = [model for model in self.all_models() if model not in loaded]
+        if evicted:
+            logger.info(f"Models {evicted} were evicted, loading them again.")
+            self.rewarms += len(evicted)
+            await self.async_warm_up(evicted)
+        return evicted
+
+    def schedule_rewarm(self):
+        """
+        Starts async_rewarm as a background task of the running event loop, unless the
+        previous one is still running. Call it between iterations.
+        """
+        if self._rewarm_task is None or self._rewarm_task.done():
+            self._rewarm_task = asyncio.create_task(self.async_rewarm(), name="model-rewarm")
+        return self._rewarm_task
+
+    def stats(self) -> dict:
+        return {"models": self.all_models(), "rewarms": self.rewarms}
@@ -0,0 +1,59 @@
+import threading
+
+
+class ModelRouter:
+    """
+    Chooses the model of every LLM call by its label, "Agent.method" like in utils.llm_metrics:
+
+        ModelRouter("qwen2.5-coder", routes={
+            "Critic.evaluate": {"model": "gemma2:2b", "escalate_to": "qwen2.5-coder", "escalate_after": 1},
+            "Actor._get_tool_decision": {"model": "gemma2:2b", "escalate_to": "qwen2.5-coder"},
+        })
+
+    Labels without a route use default_model. A route escalates to the bigger `escalate_to` model
+    from retry attempt `escalate_after` on (e.g. 1: a failed parse is retried on the bigger model),
+    and whenever the agent asks for it because the small model's answer looks unreliable.
+    Without `escalate_after` only the agent's explicit requests escalate.
+    """
+
+    def __init__(self, default_model: str, routes: dict = None):
+        self.default_model = default_model
+        self.routes = routes or {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def route(self, label: str) -> dict:
+        route = self.routes.get(label) or {}
+        return {"model": route.get("model") or self.default_model, "escalate_to": route.get("escalate_to"),
+                "escalate_after": route.get("escalate_after")}
+
+    def can_escalate(self, label: str) -> bool:
+        route = self.route(label)
+        return bool(route["escalate_to"]) and route["escalate_to"] != route["model"]
+
+    def model(self, label: str, attempt: int = 0, escalate: bool = False) -> str:
+        """The model of attempt `attempt` (0-based) of the call; escalate=True asks for the bigger model."""
+        route = self.route(label)
+        escalated = self.can_escalate(label) and (
+            escalate or (route["escalate_after"] is not None and attempt >= route["escalate_after"])
+        )
+        with self._lock:
+            stats = self._stats.setdefault(label, {"calls": 0, "escalated": 0})
+            stats["calls"] += 1
+            if escalated:
+                stats["escalated"] += 1
+        return route["escalate_to"] if escalated else route["model"]
+
+    def models(self) -> list:
+        """Every model the routes can use, default model first."""
+        models = [self.default_model]
+        for route in self.routes.values():
+            for model in (route.get("model"), route.get("escalate_to")):
+                if model and model not in models:
+                    models.append(model)
+        return models
+
+    def stats(self) -> dict:
+        """Per-label number of routed calls and how many of them went to the escalation model."""
+        with self._lock:
+            return {label: dict(stats) for label, stats in self._stats.items()}
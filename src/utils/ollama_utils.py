@@ -1,6 +1,294 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+import httpx
 import ollama
+from utils.llm_cache import request_key
+from utils.llm_session import FALLBACK_ERROR, ReplayMissError, embed_key
+from utils.json_utils import JsonStreamDetector
+from utils.prompt_budget import calibrate_tokens
+from utils.llm_metrics import record_llm_call
+from utils.tracing import span
 
-def ollama_call(messages, model='gemma2:2b'):
+logger = logging.getLogger(__name__)
+
+# Connection settings shared by all Ollama clients, see configure_client
+_client_settings = {"host": None, "timeout": None, "max_connections": 8, "keep_alive": None, "num_parallel": 4}
+# One pooled AsyncClient per event loop: httpx connections can't be shared across loops
+_async_clients = weakref.WeakKeyDictionary()
+
+# Background event loop used to run coroutines from synchronous code
+_loop = None
+_loop_thread = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+# Optional response cache (utils.llm_cache.LLMCache), disabled unless configured
+_llm_cache = None
+
+# Optional session recording/replay (utils.llm_session), see configure_session
+_recorder = None
+_replay = None
+
+# Last prompts of each model, one per server slot, see prefix_cache_stats
+_slot_prompts = {}
+_prefix_stats = {"calls": 0, "prompt_chars": 0, "shared_chars": 0}
+_prefix_lock = threading.Lock()
+
+# Attempts used by the agents' parse-retry loops: {label: {"calls", "attempts", "failures", "repaired", "repairs"}}
+_retry_stats = {}
+_retry_lock = threading.Lock()
+
+
+def configure_client(host=None, timeout=None, max_connections=8, keep_alive=None, num_parallel=4):
+    """
+    Sets the Ollama host (defaults to $OLLAMA_HOST), the request timeout in seconds
+    and the size of the HTTP connection pool.
+    Keep max_connections >= OLLAMA_NUM_PARALLEL to overlap requests on the server.
+    keep_alive (e.g. "30m", or -1 for ever) is sent with every request so the model,
+    and with it the KV cache of the last prompt, stays loaded between calls;
+    None uses the server's default (5 minutes).
+    num_parallel should match the server's OLLAMA_NUM_PARALLEL, it's only used by prefix_cache_stats.
+    """
+    _client_settings.update(host=host, timeout=timeout, max_connections=max_connections, keep_alive=keep_alive,
+                            num_parallel=num_parallel)
+    _async_clients.clear()
+
+
+def _keep_alive() -> dict:
+    """keep_alive argument of the Ollama calls, empty unless configured."""
+    keep_alive = _client_settings["keep_alive"]
+    return {} if keep_alive is None else {"keep_alive": keep_alive}
+
+
+def get_async_client() -> ollama.AsyncClient:
+    """Returns the pooled AsyncClient of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        max_connections = _client_settings["max_connections"]
+        client = ollama.AsyncClient(
+            host=_client_settings["host"],
+            timeout=_client_settings["timeout"],
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _background_loop():
+    """Starts (once per process) the event loop thread used by run_sync."""
+    global _loop, _loop_thread, _loop_pid
+    with _loop_lock:
+        # A forked child doesn't inherit the loop thread, so it needs its own loop
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="ollama-event-loop", daemon=True)
+            _loop_thread.start()
+            _loop_pid = os.getpid()
+        return _loop
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine on the shared background event loop and waits for its result.
+    This is what the synchronous agent API is built on, so all synchronous calls
+    share one connection pool.
+    """
+    loop = _background_loop()
+    if threading.current_thread() is _loop_thread:
+        coroutine.close()
+        raise RuntimeError("run_sync() can't be called from the shared event loop, await the coroutine instead.")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def configure_llm_cache(cache):
+    """
+    Enables caching of ollama_call responses with the given LLMCache.
+    Pass None to disable it again.
+    """
+    global _llm_cache
+    _llm_cache = cache
+
+
+def llm_cache_stats() -> dict:
+    """Hit/miss counters of the configured LLM cache (empty if caching is disabled)."""
+    return _llm_cache.stats() if _llm_cache is not None else {}
+
+
+def configure_session(recorder=None, replay=None):
+    """
+    Enables recording of live LLM calls with a utils.llm_session.SessionRecorder and/or
+    answering them from a recorded session with a utils.llm_session.SessionReplay.
+    Pass None to disable either again.
+    """
+    global _recorder, _replay
+    _recorder = recorder
+    _replay = replay
+
+
+def session_stats() -> dict:
+    """Replay hits/misses and the number of recorded calls of the configured session."""
+    stats = {}
+    if _replay is not None:
+        stats["replay"] = _replay.stats()
+    if _recorder is not None:
+        stats["recorded"] = _recorder.recorded
+    return stats
+
+
+async def _from_session(kind: str, key: str, request: dict):
+    """
+    Answers a request from the replayed session, or from its fallback if the session
+    doesn't have it. Returns (True, response), or (False, None) if the call should go to Ollama.
+    """
+    replayed = _replay.lookup(key)
+    if replayed is not None:
+        response, duration = replayed
+        if _replay.simulate_latency and duration:
+            await asyncio.sleep(duration)
+        return True, response
+    if _replay.fallback == FALLBACK_ERROR:
+        raise ReplayMissError(f"{kind} request {key} is not in the replayed session {_replay.path}")
+    if callable(_replay.fallback):
+        return True, await asyncio.to_thread(_replay.fallback, request)
+    logger.debug(f"{kind} request {key} is not in the replayed session, calling Ollama.")
+    return False, None
+
+
+def record_attempts(label: str, attempts: int, succeeded: bool = True, repairs: int = 0):
+    """
+    Records how many LLM calls a retry loop (e.g. "Critic.evaluate") needed
+    to get a usable answer, and how many JSON repairs made the last answer usable.
+    Every repaired answer is a retry call that didn't have to be made.
+    """
+    with _retry_lock:
+        stats = _retry_stats.setdefault(label, {"calls": 0, "attempts": 0, "failures": 0, "repaired": 0, "repairs": 0})
+        stats["calls"] += 1
+        stats["attempts"] += attempts
+        if not succeeded:
+            stats["failures"] += 1
+        if repairs:
+            stats["repaired"] += 1
+            stats["repairs"] += repairs
+
+
+def retry_stats() -> dict:
+    """Per-label retry counters with the average number of LLM calls per loop."""
+    with _retry_lock:
+        return {
+            label: {**stats, "attempts_per_call": stats["attempts"] / stats["calls"]}
+            for label, stats in _retry_stats.items()
+        }
+
+
+def _prompt_text(messages) -> str:
+    """The messages the way they are laid out in the model's context, close enough to compare prefixes."""
+    return "".join(f"<{message.get('role')}>{message.get('content') or ''}\n" for message in messages)
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    """Length of the common prefix of a and b, by bisection over slice comparisons."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _track_prefix(model: str, messages) -> int:
+    """
+    Counts how many prompt characters the request shares with an earlier prompt of the same model.
+    Ollama keeps the KV cache of the last prompt of each of its num_parallel slots, runs a request
+    in the slot with the longest common prefix and only evaluates the part after it.
+    The same choice is simulated here, so the result is what the server could reuse.
+    """
+    text = _prompt_text(messages)
+    with _prefix_lock:
+        slots = _slot_prompts.setdefault(model, [])
+        shared, best = 0, None
+        for index, prompt in enumerate(slots):
+            length = _common_prefix_length(text, prompt)
+            if length > shared:
+                shared, best = length, index
+        if best is not None:
+            del slots[best]
+        elif len(slots) >= _client_settings["num_parallel"]:
+            # No prefix to reuse: the least recently used slot is taken
+            del slots[0]
+        slots.append(text)
+        _prefix_stats["calls"] += 1
+        _prefix_stats["prompt_chars"] += len(text)
+        _prefix_stats["shared_chars"] += shared
+    return shared
+
+
+def prefix_cache_stats() -> dict:
+    """
+    Share of the prompt characters sent to Ollama that repeat the start of an earlier prompt
+    still held by one of the model's slots. It's an estimate of the server's prefix cache hit
+    ratio: it assumes the configured num_parallel and that no other client uses the server.
+    """
+    with _prefix_lock:
+        stats = dict(_prefix_stats)
+    stats["hit_ratio"] = stats["shared_chars"] / stats["prompt_chars"] if stats["prompt_chars"] else 0.0
+    return stats
+
+
+def _calibrate(request: dict, response, shared_chars: int = 0):
+    """
+    Feeds the prompt token count reported by Ollama to the prompt budget's token estimate.
+    prompt_eval_count only counts the tokens that weren't reused from the prefix cache,
+    so they're matched with the characters after the shared prefix; mostly cached prompts are skipped.
+    """
+    chars = sum(len(message.get('content') or '') for message in request['messages'])
+    if shared_chars * 2 > chars:
+        return
+    calibrate_tokens(request['model'], chars - shared_chars, response.get('prompt_eval_count'))
+
+
+async def _stream_until_json(client, request: dict, shared_chars: int = 0):
+    """
+    Streams a completion and stops reading once the first top-level JSON object or
+    array is complete and more content follows it. Closing the stream drops the HTTP
+    response, which makes Ollama cancel the rest of the generation. Chunks without
+    content after the value are still read, so an answer that ends with the value
+    (e.g. one constrained by format) keeps its final chunk with Ollama's counters.
+    Returns (text, final chunk with Ollama's counters or None if stopped early, number of chunks).
+    """
+    detector = JsonStreamDetector()
+    started_at = time.perf_counter()
+    final = None
+    chunks = 0
+    stream = await client.chat(**request, stream=True, **_keep_alive())
+    try:
+        async for chunk in stream:
+            chunks += 1
+            was_complete = detector.complete
+            was_started = detector.started
+            content = chunk['message']['content']
+            if chunk.get('done'):
+                final = chunk
+                _calibrate(request, chunk, shared_chars)
+            if was_complete and content.strip() and not chunk.get('done'):
+                logger.debug(f"JSON complete after {len(detector.text)} chars in {time.perf_counter() - started_at:.2f}s, "
+                             f"stopping generation.")
+                break
+            detector.feed(content)
+            if detector.started and not was_started:
+                logger.debug(f"JSON output started after {time.perf_counter() - started_at:.2f}s.")
+    finally:
+        await stream.aclose()
+    return detector.text, final, chunks
+
+
+async def async_ollama_call(messages, model='gemma2:2b', options=None, use_cache=True, stream_json=False, format=None):
     """
     Calls Ollama LLM with the given messages and model.
     messages should be a list of dicts like:
@@ -8,6 +296,98 @@ def ollama_call(messages, model='gemma2:2b'):
        {"role": "system", "content": "..."},
        {"role": "user", "content": "..."}
     ]
+    options are passed to Ollama as model parameters (temperature, seed, ...).
+    If a cache is configured, identical requests are answered from it.
+    Set use_cache=False to force a fresh sample (the new answer still replaces the cached one).
+    With stream_json=True the answer is streamed and generation stops once the first
+    complete JSON value has arrived, so trailing prose isn't waited for.
+    format is passed to Ollama to constrain the output: "json" or a JSON schema dict.
+    Every call is recorded in utils.llm_metrics with the tags of utils.llm_metrics.llm_call_tags.
     """
-    response = ollama.chat(model=model, messages=messages)
-    return response['message']['content']
\ No newline at end of file
+    request = {"model": model, "messages": messages, "options": options, "format": format}
+    started_at = time.perf_counter()
+    key = None
+    if _llm_cache is not None or _replay is not None or _recorder is not None:
+        key = request_key(model, messages, options, format)
+    if _replay is not None:
+        replayed, content = await _from_session("chat", key, request)
+        if replayed:
+            record_llm_call(model, time.perf_counter() - started_at, replayed=True)
+            return content
+    if _llm_cache is not None and use_cache:
+        cached = _llm_cache.get(key)
+        if cached is not None:
+            record_llm_call(model, time.perf_counter() - started_at, cached=True)
+            return cached
+
+    chunks = 0
+    shared_chars = _track_prefix(model, messages)
+    try:
+        with span("llm.chat", category="llm", model=model, stream_json=stream_json, shared_prefix=shared_chars):
+            if stream_json:
+                content, response, chunks = await _stream_until_json(get_async_client(), request, shared_chars)
+            else:
+                response = await get_async_client().chat(**request, **_keep_alive())
+                _calibrate(request, response, shared_chars)
+                content = response['message']['content']
+    except Exception as e:
+        record_llm_call(model, time.perf_counter() - started_at, error=f"{type(e).__name__}: {e}")
+        raise
+    duration = time.perf_counter() - started_at
+    record_llm_call(model, duration, response=response, stopped_early=response is None, chunks=chunks)
+    if _llm_cache is not None:
+        _llm_cache.put(key, content)
+    if _recorder is not None:
+        _recorder.record("chat", key, model, {"messages": messages, "options": options, "format": format,
+                                              "stream_json": stream_json}, content, duration)
+    return content
+
+
+def ollama_call(messages, model='gemma2:2b', options=None, use_cache=True, stream_json=False, format=None):
+    """Synchronous version of async_ollama_call."""
+    return run_sync(async_ollama_call(messages, model=model, options=options, use_cache=use_cache,
+                                      stream_json=stream_json, format=format))
+
+
+async def async_ollama_embed(texts, model='nomic-embed-text'):
+    """
+    Embeds a list of texts with an Ollama embedding model.
+    Returns a list of vectors, one per text.
+    Embeddings are recorded and replayed like chat calls, see configure_session.
+    """
+    texts = list(texts)
+    key = embed_key(model, texts) if _replay is not None or _recorder is not None else None
+    if _replay is not None:
+        replayed, embeddings = await _from_session("embed", key, {"model": model, "input": texts})
+        if replayed:
+            return embeddings
+    started_at = time.perf_counter()
+    with span("llm.embed", category="llm", model=model, texts=len(texts)):
+        response = await get_async_client().embed(model=model, input=texts, **_keep_alive())
+    embeddings = [list(vector) for vector in response['embeddings']]
+    if _recorder is not None:
+        _recorder.record("embed", key, model, {"input": texts}, embeddings, time.perf_counter() - started_at)
+    return embeddings
+
+
+async def async_load_model(model: str, embedding: bool = False, keep_alive=None) -> dict:
+    """
+    Loads a model into the server's memory without generating anything: an empty chat
+    (or an empty embedding request for embedding models).
+    keep_alive defaults to the one set with configure_client. Returns Ollama's final response,
+    its load_duration says how long the load took (0 if the model was loaded already).
+    """
+    options = {"keep_alive": keep_alive} if keep_alive is not None else _keep_alive()
+    started_at = time.perf_counter()
+    with span("llm.load", category="llm", model=model):
+        if embedding:
+            response = await get_async_client().embed(model=model, input="", **options)
+        else:
+            response = await get_async_client().chat(model=model, messages=[], **options)
+    record_llm_call(model, time.perf_counter() - started_at, response=response)
+    return response
+
+
+def ollama_embed(texts, model='nomic-embed-text'):
+    """Synchronous version of async_ollama_embed."""
+    return run_sync(async_ollama_embed(texts, model=model))
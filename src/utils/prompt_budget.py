@@ -0,0 +1,176 @@
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Used until a model was calibrated from Ollama's prompt_eval_count
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# Default token budgets of the prompt sections
+DEFAULT_BUDGETS = {
+    "tools": 1500,      # Tool catalogue shown to the agents
+    "artifacts": 3000,  # Outputs of previous subtasks / attempts
+    "feedback": 800,    # Critic reports
+    "memory": 1500,     # Long-term notes
+    "plan": 1000,       # Previous plan shown to the replanner
+}
+
+EXCERPT_MARKER = "\n...[{omitted} chars omitted]...\n"
+MIN_EXCERPT_CHARS = 40
+
+# Calibrated characters per token: {model: ratio}
+_chars_per_token = {}
+# Tokens saved by compaction: {label: {"calls", "compacted", "tokens_before", "tokens_after"}}
+_savings = {}
+_lock = threading.Lock()
+
+
+def calibrate_tokens(model: str, chars: int, tokens: int):
+    """
+    Updates the characters-per-token estimate of a model from a real request:
+    chars of prompt text that Ollama counted as tokens (prompt_eval_count).
+    """
+    if not model or chars <= 0 or not tokens or tokens <= 0:
+        return
+    # Clamp to sane values, e.g. a partially cached prompt reports fewer evaluated tokens
+    ratio = min(max(chars / tokens, 1.0), 10.0)
+    with _lock:
+        previous = _chars_per_token.get(model)
+        _chars_per_token[model] = ratio if previous is None else 0.8 * previous + 0.2 * ratio
+
+
+def chars_per_token(model: str = None) -> float:
+    with _lock:
+        return _chars_per_token.get(model, DEFAULT_CHARS_PER_TOKEN)
+
+
+def count_tokens(text, model: str = None) -> int:
+    """Estimated number of tokens of text (anything else is counted as str(text)) for the model."""
+    if not isinstance(text, str):
+        text = str(text)
+    return math.ceil(len(text) / chars_per_token(model))
+
+
+def excerpt(text: str, max_chars: int) -> str:
+    """
+    Shortens text to about max_chars by keeping its head and tail.
+    The cut only depends on the text and max_chars, so the same output always
+    gives the same excerpt.
+    """
+    if len(text) <= max_chars:
+        return text
+    marker = EXCERPT_MARKER.format(omitted=len(text))
+    available = max(max_chars - len(marker), MIN_EXCERPT_CHARS)
+    if available >= len(text):
+        return text
+    head = available * 2 // 3
+    tail = available - head
+    omitted = len(text) - head - tail
+    return text[:head] + EXCERPT_MARKER.format(omitted=omitted) + text[len(text) - tail:]
+
+
+def _leaves(value, found: list):
+    """Collects the lengths of the text leaves of a nested dict/list structure."""
+    if isinstance(value, dict):
+        for item in value.values():
+            _leaves(item, found)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _leaves(item, found)
+    elif isinstance(value, (bool, int, float)) or value is None:
+        pass
+    else:
+        found.append(len(value if isinstance(value, str) else str(value)))
+    return found
+
+
+def _leaf_cap(lengths: list, budget: int) -> int:
+    """Largest per-leaf length cap such that the capped leaves fit into budget chars."""
+    lengths = sorted(lengths)
+    remaining = budget
+    for index, length in enumerate(lengths):
+        share = remaining // (len(lengths) - index)
+        if length > share:
+            return share
+        remaining -= length
+    return lengths[-1] if lengths else 0
+
+
+def _cap_leaves(value, cap: int):
+    if isinstance(value, dict):
+        return {key: _cap_leaves(item, cap) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_cap_leaves(item, cap) for item in value]
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    text = value if isinstance(value, str) else str(value)
+    return excerpt(text, cap)
+
+
+def compact(value, max_tokens: int, model: str = None):
+    """
+    Fits value into max_tokens when it's interpolated into a prompt.
+    Strings are excerpted; in dicts and lists the longest text leaves are shortened
+    first, so small fields (tool names, flags) stay intact and the structure is kept.
+    """
+    ratio = chars_per_token(model)
+    max_chars = int(max_tokens * ratio)
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= max_chars:
+        return value
+    if isinstance(value, str):
+        return excerpt(value, max_chars)
+    if isinstance(value, (dict, list, tuple)):
+        lengths = _leaves(value, [])
+        overhead = len(text) - sum(lengths)
+        if lengths and overhead < max_chars:
+            # Leave some room for the markers and the quotes/escapes str() adds around the leaves
+            cap = _leaf_cap(lengths, int((max_chars - overhead) * 0.9))
+            compacted = _cap_leaves(value, max(cap, MIN_EXCERPT_CHARS))
+            if len(str(compacted)) <= max_chars:
+                return compacted
+            text = str(compacted)
+    return excerpt(text, max_chars)
+
+
+def budget_stats() -> dict:
+    """Per-label token savings of prompt compaction."""
+    with _lock:
+        return {
+            label: {**stats, "tokens_saved": stats["tokens_before"] - stats["tokens_after"]}
+            for label, stats in _savings.items()
+        }
+
+
+class PromptBudget:
+    """
+    Per-section token budgets for the agents' prompts.
+
+    fit() shrinks a prompt section (tools, artifacts, feedback, memory, plan) to its
+    budget with compact() and logs how many tokens that saved for the calling agent.
+    Sections without a budget are passed through.
+    """
+
+    def __init__(self, model: str = None, budgets: dict = None):
+        self.model = model
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+
+    def fit(self, label: str, section: str, value):
+        """Returns value compacted to the budget of section; label names the agent call for the logs."""
+        max_tokens = self.budgets.get(section)
+        if value is None or max_tokens is None:
+            return value
+        before = count_tokens(value, self.model)
+        compacted = compact(value, max_tokens, self.model) if before > max_tokens else value
+        after = count_tokens(compacted, self.model) if compacted is not value else before
+        with _lock:
+            stats = _savings.setdefault(label, {"calls": 0, "compacted": 0, "tokens_before": 0, "tokens_after": 0})
+            stats["calls"] += 1
+            stats["tokens_before"] += before
+            stats["tokens_after"] += after
+            if after < before:
+                stats["compacted"] += 1
+        if after < before:
+            logger.info(f"{label}: {section} compacted from ~{before} to ~{after} tokens, saved ~{before - after}.")
+        return compacted
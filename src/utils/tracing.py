@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+# Tracing is off by default: span() then returns a shared no-op context manager
+_enabled = False
+_events = deque(maxlen=1_000_000)
+_lock = threading.Lock()
+
+# Chrome trace "threads": one lane per asyncio task, so concurrent tasks on the
+# event loop thread don't overlap, and one per OS thread outside of tasks
+_task_lanes = weakref.WeakKeyDictionary()
+_lane_names = {}
+_next_lane = 1
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable_tracing(max_events: int = 1_000_000):
+    """Starts recording spans, keeping at most max_events of them."""
+    global _enabled, _events
+    with _lock:
+        _events = deque(_events, maxlen=max_events)
+        _enabled = True
+
+
+def disable_tracing():
+    global _enabled
+    _enabled = False
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+def clear_trace():
+    with _lock:
+        _events.clear()
+
+
+def _lane() -> int:
+    global _next_lane
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    with _lock:
+        if task is None:
+            thread = threading.current_thread()
+            lane = thread.ident
+            _lane_names.setdefault(lane, thread.name)
+            return lane
+        lane = _task_lanes.get(task)
+        if lane is None:
+            lane = _task_lanes[task] = _next_lane
+            _next_lane += 1
+            _lane_names[lane] = task.get_name()
+        return lane
+
+
+class _Span:
+    __slots__ = ("name", "category", "args", "started_at")
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.started_at = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended_at = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        event = {
+            "name": self.name, "cat": self.category, "ph": "X",
+            "ts": self.started_at / 1000, "dur": (ended_at - self.started_at) / 1000,
+            "pid": os.getpid(), "tid": _lane(),
+        }
+        if self.args:
+            event["args"] = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                             for key, value in self.args.items()}
+        with _lock:
+            _events.append(event)
+        return False
+
+
+def span(name: str, category: str = "sokrates", **args):
+    """
+    Times the block as a span of the trace, e.g. with span("tool.run", tool=name): ...
+    Spans nest by time within the same asyncio task or thread.
+    Does nothing while tracing is disabled.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, category, args)
+
+
+def traced(name: str, category: str = "sokrates"):
+    """Decorator version of span() for functions and coroutine functions."""
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await function(*args, **kwargs)
+                with _Span(name, category, {}):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_chrome_trace(path: str) -> int:
+    """
+    Writes the recorded spans as a Chrome trace / Perfetto JSON file
+    (open it in chrome://tracing or ui.perfetto.dev). Returns the number of spans.
+    """
+    with _lock:
+        events = list(_events)
+        lane_names = dict(_lane_names)
+    pid = os.getpid()
+    metadata = [
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": lane, "args": {"name": lane_name}}
+        for lane, lane_name in lane_names.items()
+    ]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+    os.replace(tmp_path, path)
+    return len(events)